@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+import gc, time, pickle
+from argparse import ArgumentParser
+from expression import Expression
+from config import global_config
+from main import solvers
+import codec
+
+def same(x, y):
+    if type(x) is not type(y):
+        return False
+    if type(x) is Expression:
+        return x.name == y.name and len(x.args) == len(y.args) and all(map(same, x.args, y.args))
+    if type(x) is tuple:
+        return len(x) == len(y) and all(map(same, x, y))
+    return x == y
+
+def timed(f, *args, **kwargs):
+    start = time.perf_counter()
+    result = f(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def benchmark_codec(options):
+    solver = solvers[options.solver]["solver"]
+    tchisla = solver.detached(options.n)
+    # an unreachable target, every layer up to the depth is complete
+    tchisla.solve(10 ** 100 + 1, max_depth = options.depth)
+    print("{} #{}, depth {}".format(options.solver, options.n, options.depth))
+    row = "{:>5} {:>8} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}"
+    print(row.format("depth", "values", "bytes", "pickled", "encode", "decode", "pickle", "unpickle"))
+    for digits in range(1, options.depth + 1):
+        layer = [(x, tchisla.solutions[x]) for x in tchisla.visited[digits]]
+        data, encode_time = timed(codec.dumps, layer)
+        decoded, decode_time = timed(codec.loads, data)
+        assert len(decoded) == len(layer) and all(map(same, decoded, layer)), "round trip failed at depth {}".format(digits)
+        pickled, pickle_time = timed(pickle.dumps, layer, pickle.HIGHEST_PROTOCOL)
+        unpickled, unpickle_time = timed(pickle.loads, pickled)
+        assert all(map(same, unpickled, layer)), "pickle round trip failed at depth {}".format(digits)
+        rate = lambda seconds: "{:.0f}k/s".format(len(layer) / seconds / 1000) if seconds else "-"
+        print(row.format(
+            digits, len(layer), len(data), len(pickled),
+            rate(encode_time), rate(decode_time), rate(pickle_time), rate(unpickle_time)
+        ), flush = True)
+
+def layers_signature(tchisla):
+    # every entry in insertion order, expressions compared through their structure
+    def structure(x):
+        return (x.name, tuple(map(structure, x.args))) if type(x) is Expression else x
+    return [(x, tchisla.solutions[x][0], structure(tchisla.solutions[x][1])) for layer in tchisla.visited[1:] for x in layer]
+
+def benchmark_fused(options):
+    solver = solvers[options.solver]["solver"]
+    print("{} #{}, depth {}, best of {}".format(options.solver, options.n, options.depth, options.repeat))
+    signatures = []
+    for fused in ((), (options.solver,)):
+        global_config["fused"] = fused
+        best = tchisla = None
+        for _ in range(options.repeat):
+            # the layers of the previous run would weigh on the allocator and the collector
+            tchisla = None
+            gc.collect()
+            tchisla = solver.detached(options.n)
+            _, seconds = timed(tchisla.solve, 10 ** 100 + 1, max_depth = options.depth)
+            best = seconds if best is None else min(best, seconds)
+        signatures.append(layers_signature(tchisla))
+        print("{:>8}: {:.2f}s, {} values".format("fused" if fused else "generic", best, len(tchisla.solutions)), flush = True)
+    assert signatures[0] == signatures[1], "fused and generic expansions differ"
+    print("identical layers, depths and expressions")
+
+def main():
+    parser = ArgumentParser(description='solver benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+    codec_parser = commands.add_parser('codec', help='round trip and throughput of the binary codec on whole layers, against pickle')
+    codec_parser.add_argument('-s', '--solver',
+        choices=list(solvers.keys()),
+        default='quadratic'
+    )
+    codec_parser.add_argument('-n',
+        type=int,
+        default=4,
+        help='digit'
+    )
+    codec_parser.add_argument('-d', '--depth',
+        type=int,
+        default=4
+    )
+    fused_parser = commands.add_parser('fused', help='time of the specialized expansion loop of a solver against the generic one, checking they give the same layers')
+    fused_parser.add_argument('-s', '--solver',
+        choices=list(solvers.keys()),
+        default='integral'
+    )
+    fused_parser.add_argument('-n',
+        type=int,
+        default=7,
+        help='digit'
+    )
+    fused_parser.add_argument('-d', '--depth',
+        type=int,
+        default=7
+    )
+    fused_parser.add_argument('-r', '--repeat',
+        type=int,
+        default=3
+    )
+    options = parser.parse_args()
+    if options.command == 'codec':
+        benchmark_codec(options)
+    elif options.command == 'fused':
+        benchmark_fused(options)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+from gmpy2 import mpz, mpq as Fraction
+from expression import Expression, operators
+from quadratic import Quadratic, primes, mpz_type, mpq_type
+
+__all__ = ["dumps", "loads"]
+
+# a byte tag per object, small non-negative integers are the tag itself
+NONE, INT, MPZ, MPQ, QUADRATIC, EXPRESSION, REFERENCE, TUPLE, LIST, STR = range(10)
+SMALL_INT = 0x80
+
+# expression names are indexes in this table, unknown names follow as strings
+names = tuple(operators)
+name_index = {name: index for index, name in enumerate(names)}
+
+# quadratic parts are the powers of the square roots of primes
+quadratic_part_size = range(len(primes))
+
+def write_varint(buffer, n):
+    while n >= 0x80:
+        buffer.append(n & 0x7f | 0x80)
+        n >>= 7
+    buffer.append(n)
+
+def write_integer(buffer, n, signed = True):
+    data = int(n).to_bytes((n.bit_length() + 8) >> 3 if signed else (n.bit_length() + 7) >> 3, "little", signed = signed)
+    write_varint(buffer, len(data))
+    buffer += data
+
+def write_string(buffer, string):
+    data = string.encode()
+    write_varint(buffer, len(data))
+    buffer += data
+
+class Encoder:
+    __slots__ = ("buffer", "memo", "keep")
+
+    def __init__(self):
+        self.buffer = bytearray()
+        # numbers and expressions already written, by value and by identity
+        self.memo = {}
+        self.keep = []
+
+    def remember(self, key):
+        self.memo[key] = len(self.memo)
+
+    def encode(self, x):
+        buffer = self.buffer
+        kind = type(x)
+        if kind is int and 0 <= x < SMALL_INT:
+            buffer.append(SMALL_INT | x)
+            return
+        if x is None:
+            buffer.append(NONE)
+            return
+        if kind is tuple or kind is list:
+            buffer.append(TUPLE if kind is tuple else LIST)
+            write_varint(buffer, len(x))
+            for item in x:
+                self.encode(item)
+            return
+        if kind is str:
+            buffer.append(STR)
+            write_string(buffer, x)
+            return
+        # expressions are shared between the entries of a layer, numbers are
+        # the leaves of most of them
+        key = id(x) if kind is Expression else (kind, x)
+        index = self.memo.get(key)
+        if index is not None:
+            buffer.append(REFERENCE)
+            write_varint(buffer, index)
+            return
+        if kind is Expression:
+            buffer.append(EXPRESSION)
+            index = name_index.get(x.name)
+            if index is None:
+                write_varint(buffer, len(names) + len(x.name.encode()))
+                buffer += x.name.encode()
+            else:
+                write_varint(buffer, index)
+            write_varint(buffer, len(x.args))
+            for arg in x.args:
+                self.encode(arg)
+            # ids are only unique among live objects
+            self.keep.append(x)
+        elif kind is int or kind is mpz_type:
+            buffer.append(INT if kind is int else MPZ)
+            write_integer(buffer, x)
+        elif kind is mpq_type:
+            buffer.append(MPQ)
+            write_integer(buffer, x.numerator)
+            write_integer(buffer, x.denominator, signed = False)
+        elif kind is Quadratic:
+            buffer.append(QUADRATIC)
+            write_integer(buffer, x.rational_part.numerator)
+            write_integer(buffer, x.rational_part.denominator, signed = False)
+            write_varint(buffer, x.quadratic_power)
+            if x.quadratic_power:
+                for power in x.quadratic_part:
+                    write_varint(buffer, power)
+        else:
+            raise TypeError("cannot encode " + kind.__name__)
+        self.remember(key)
+
+class Decoder:
+    __slots__ = ("data", "position", "memo")
+
+    def __init__(self, data):
+        self.data = memoryview(data)
+        self.position = 0
+        self.memo = []
+
+    def read_varint(self):
+        data = self.data
+        n = data[self.position]
+        self.position += 1
+        if n < 0x80:
+            return n
+        n &= 0x7f
+        shift = 7
+        while True:
+            byte = data[self.position]
+            self.position += 1
+            n |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return n
+            shift += 7
+
+    def read_bytes(self, size):
+        start = self.position
+        self.position += size
+        return self.data[start:self.position]
+
+    def read_integer(self, signed = True):
+        return int.from_bytes(self.read_bytes(self.read_varint()), "little", signed = signed)
+
+    def decode(self):
+        tag = self.data[self.position]
+        self.position += 1
+        if tag >= SMALL_INT:
+            return tag ^ SMALL_INT
+        if tag == REFERENCE:
+            return self.memo[self.read_varint()]
+        if tag == EXPRESSION:
+            index = self.read_varint()
+            name = names[index] if index < len(names) else str(self.read_bytes(index - len(names)), "utf-8")
+            args = [self.decode() for _ in range(self.read_varint())]
+            x = Expression(name, *args)
+        elif tag == INT:
+            x = self.read_integer()
+        elif tag == MPZ:
+            x = mpz(self.read_integer())
+        elif tag == MPQ:
+            numerator = self.read_integer()
+            x = Fraction(numerator, self.read_integer(signed = False))
+        elif tag == QUADRATIC:
+            numerator = self.read_integer()
+            rational_part = Fraction(numerator, self.read_integer(signed = False))
+            quadratic_power = self.read_varint()
+            if quadratic_power:
+                quadratic_part = tuple(self.read_varint() for _ in quadratic_part_size)
+                x = Quadratic(rational_part, quadratic_power, quadratic_part)
+            else:
+                x = Quadratic(rational_part)
+        elif tag == NONE:
+            return None
+        elif tag == TUPLE:
+            return tuple(self.decode() for _ in range(self.read_varint()))
+        elif tag == LIST:
+            return [self.decode() for _ in range(self.read_varint())]
+        elif tag == STR:
+            return str(self.read_bytes(self.read_varint()), "utf-8")
+        else:
+            raise ValueError("unknown tag " + str(tag))
+        self.memo.append(x)
+        return x
+
+def dumps(x):
+    encoder = Encoder()
+    encoder.encode(x)
+    return bytes(encoder.buffer)
+
+def loads(data):
+    return Decoder(data).decode()
@@ -1,10 +1,40 @@
+import json
+from functools import lru_cache
 from quadratic import Quadratic
 from expression import Expression
 
 __all__ = ["global_config"]
 
 global_config = {
-	"verbose": False
+	"verbose": False,
+	# iterate layers sorted by magnitude to skip out of range pairs early
+	"sorted_layers": False,
+	# solvers expanding with their specialized loop instead of the generic one
+	"fused": (),
+	# look the target up among the cheap operators of each value before expanding a depth
+	"target_pass": False,
+	# in searches bounded by a depth, drop the values of the last depths that
+	# cannot reach the target within the remaining digits, the next search of
+	# the instance computes them again
+	"budget_pruning": False,
+	# threads expanding each depth, only used when the GIL is disabled
+	"threads": 1,
+	# worker processes expanding each depth, reading the layers from shared memory
+	"processes": 1,
+	# file receiving a JSON line of memory accounting for each finished depth
+	"memory_report": None,
+	# JSON file of per-solver, per-digit limits overrides, as written by tune.py
+	"limits_profile": None,
+	# limits on the estimated cost of the next depth, and what to do beyond them:
+	# "refuse" gives up, "defer" postpones the problem, "downgrade" searches
+	# the depth for the target only without keeping it
+	"admission": {
+		"max_pairs": None,
+		"max_values": None,
+		"max_memory": None,
+		"max_time": None,
+		"policy": "refuse"
+	}
 }
 
 limits = {
@@ -35,9 +65,21 @@ limits = {
 	}
 }
 
+# {solver: {digit: {limit: value}}}, digits are strings in JSON
+@lru_cache()
+def load_limits_profile(path):
+	with open(path) as f:
+		return json.load(f)
+
+# the packed and canonical rational solvers share the limits of the rational one
+limits["packed"] = limits["rational"]
+limits["canonical"] = limits["rational"]
+
 specials = {
 	"integral": {},
 	"rational": {},
+	"packed": {},
+	"canonical": {},
 	"quadratic": {
 		4: {
 			6: [
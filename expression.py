@@ -72,6 +72,15 @@ class Expression:
     def __str__(self):
         return Expression.str(self)
 
+    def __reduce_ex__(self, protocol):
+        # codec imports this module
+        from codec import dumps, loads
+        try:
+            return (loads, (dumps(self),))
+        except TypeError:
+            # leaves the codec has no tag for are pickled the default way
+            return object.__reduce_ex__(self, protocol)
+
     @staticmethod
     def str(expression, *, spaces = False):
         expression_operator = operators[Expression.type(expression)]
@@ -153,3 +162,54 @@ class Expression:
     @staticmethod
     def factorial(x):
         return Expression("factorial", x)
+
+    # compound builders, the solvers pass them around in place of built expressions
+    @staticmethod
+    def negative_power(x, y):
+        return Expression.power(x, Expression.negate(y))
+
+    @staticmethod
+    def folded_power(folds, x, y):
+        expression = Expression.power(x, y)
+        for _ in range(folds):
+            expression = Expression.sqrt(expression)
+        return expression
+
+    @staticmethod
+    def folded_negative_power(folds, x, y):
+        expression = Expression.negative_power(x, y)
+        for _ in range(folds):
+            expression = Expression.sqrt(expression)
+        return expression
+
+    @staticmethod
+    def factorial_quotient(x, y):
+        return Expression.divide(Expression.factorial(x), Expression.factorial(y))
+
+    @staticmethod
+    def factorial_quotient_minus_one(x, y):
+        return Expression.divide(
+            Expression.subtract(Expression.factorial(x), Expression.factorial(y)),
+            Expression.factorial(y)
+        )
+
+    @staticmethod
+    def factorial_quotient_plus_one(x, y):
+        return Expression.divide(
+            Expression.add(Expression.factorial(x), Expression.factorial(y)),
+            Expression.factorial(y)
+        )
+
+    @staticmethod
+    def factorial_quotient_half(x, y):
+        return Expression.divide(
+            Expression.factorial(x),
+            Expression.add(Expression.factorial(y), Expression.factorial(y))
+        )
+
+    @staticmethod
+    def factorial_quotient_double(x, y):
+        return Expression.divide(
+            Expression.add(Expression.factorial(x), Expression.factorial(x)),
+            Expression.factorial(y)
+        )
@@ -1,14 +1,19 @@
 #!/usr/bin/env python3
 
-import re
+import re, sys, time, json, heapq
 from argparse import ArgumentParser
 from gmpy2 import mpq as Fraction
 from config import global_config
 from quadratic import Quadratic
 from solver.integral import IntegralTchisla
 from solver.rational import RationalTchisla
+from solver.packed import PackedRationalTchisla
+from solver.canonical import CanonicalRationalTchisla
 from solver.quadratic import QuadraticTchisla
 from api import tchisla as tchisla_api
+from solver import accounting
+from solver.beam import BeamSearch
+from solver.portfolio import Portfolio
 
 integral_re = re.compile("^\\d+$")
 rational_re = re.compile("^\\d+(/\\d+)?$")
@@ -25,19 +30,142 @@ solvers = {
     "rational": {
         "regex": rational_re, "constructor": Fraction, "solver": RationalTchisla
     },
+    "packed": {
+        "regex": rational_re, "constructor": Fraction, "solver": PackedRationalTchisla
+    },
+    "canonical": {
+        "regex": rational_re, "constructor": Fraction, "solver": CanonicalRationalTchisla
+    },
     "quadratic": {
         "regex": rational_re, "constructor": Quadratic, "solver": QuadraticTchisla
     }
 }
 
-def general_solver(n, target, options):
+class TextOutput:
+    __slots__ = ("separate", "lines")
+
+    def __init__(self, deferrable = False):
+        self.separate = False
+        # the lines of a problem that may be deferred, written once it is solved
+        # like the JSON records, an attempt deferred writes nothing
+        self.lines = [] if deferrable else None
+
+    def write(self, *lines):
+        if self.lines is None:
+            print(*lines, sep = "\n", flush = True)
+        else:
+            self.lines += lines
+
+    def problem(self, target, n):
+        if self.lines is not None:
+            self.lines.clear()
+        self.write("{} # {}".format(target, n))
+        self.separate = False
+
+    def beam(self, solver_key, target, depth, solution, expression):
+        self.write("beam search ({}): {} digits or less".format(solver_key, depth), *solution, "{} = {}".format(target, expression))
+
+    def solution(self, solver_key, target, depth, solution, expression):
+        if self.separate:
+            self.write("=" * 20)
+        self.separate = bool(solution)
+        self.write(*solution, "{} = {}".format(target, expression))
+        if global_config["verbose"]:
+            print('\007', end='', flush = True)
+
+    def interrupted(self, solver_key, reason, proven):
+        self.write("{}: {}, no solution with {} digits or less".format(solver_key, reason, proven))
+
+    def new_record(self):
+        self.write('New WR Found!')
+
+    def done(self, elapsed):
+        if self.lines:
+            print(*self.lines, sep = "\n", flush = True)
+            self.lines.clear()
+
+# one JSON record per problem, written as soon as it is solved
+class JsonOutput:
+    __slots__ = ("file", "record")
+
+    def __init__(self, file):
+        self.file = file
+        self.record = None
+
+    def problem(self, target, n):
+        self.record = {"target": str(target), "n": n, "depth": None, "solver": None, "expression": None}
+
+    def beam(self, solver_key, target, depth, solution, expression):
+        self.record["beam"] = {"solver": solver_key, "depth": depth, "expression": str(expression)}
+
+    def solution(self, solver_key, target, depth, solution, expression):
+        self.record.update(depth = depth, solver = solver_key, expression = str(expression))
+
+    def interrupted(self, solver_key, reason, proven):
+        self.record.setdefault("interrupted", {})[solver_key] = {"reason": reason, "proven": proven}
+
+    def new_record(self):
+        self.record["new_wr"] = True
+
+    def done(self, elapsed):
+        self.record["time"] = round(elapsed, 6)
+        print(json.dumps(self.record), file = self.file, flush = True)
+
+def beam_solver(n, target, options, depth, deadline, output):
+    bound = None
+    for solver_key in options.solvers:
+        solver = solvers[solver_key]
+        if not solver["regex"].match(str(target)):
+            continue
+        beam = BeamSearch(solver["solver"], n, options.beam)
+        found = beam.solve(target, max_depth = depth and depth - 1, deadline = deadline)
+        if found is None:
+            continue
+        tchisla = beam.tchisla
+        output.beam(
+            solver_key, tchisla.target, found,
+            tchisla.solution_prettyprint(tchisla.target, force_print=True),
+            tchisla.full_expression(tchisla.target)
+        )
+        bound = depth = found
+    return bound
+
+def portfolio_solver(n, target, options, portfolio, depth, deadline, record, output):
+    keys = [key for key in options.solvers if solvers[key]["regex"].match(str(target))]
+    results = portfolio.solve(keys, n, target, max_depth = depth and depth - 1, deadline = deadline)
+    if any(result["interrupted"] == "deferred" for result in results.values()):
+        return False
+    # same output as the sequential search, which would only print improvements
+    for solver_key in keys:
+        result = results[solver_key]
+        if result["depth"] is None or (depth and result["depth"] >= depth):
+            if result["interrupted"] and result["interrupted"] != "outrun":
+                proven = result["depth_finished"] + (result["interrupted"] == "downgraded")
+                output.interrupted(solver_key, result["interrupted"], proven)
+            continue
+        depth = result["depth"]
+        output.solution(solver_key, solvers[solver_key]["constructor"](target), depth, result["solution"], result["expression"])
+    if depth and options.try_wr is not False:
+        if not record or record > depth:
+            output.new_record()
+    return True
+
+def general_solver(n, target, options, output, portfolio = None):
     max_depth = options.max_depth
     depth = max_depth and max_depth + 1
+    record = None
     if options.try_wr is not False:
         record = fetchRecord(target, n)
         if record:
             depth = record + int(options.try_wr)
-    solution = None
+    deadline = None if options.timeout is None else time.monotonic() + options.timeout
+    if options.beam:
+        # the beam search bound limits the depth of the exact search
+        bound = beam_solver(n, target, options, depth, deadline, output)
+        if bound:
+            depth = bound + 1
+    if portfolio is not None:
+        return portfolio_solver(n, target, options, portfolio, depth, deadline, record, output)
     for solver_key in options.solvers:
         solver = solvers[solver_key]
         if not solver["regex"].match(str(target)):
@@ -45,46 +173,54 @@ def general_solver(n, target, options):
         current_target = solver["constructor"](target)
         tchisla = solver["solver"](n)
         max_depth = depth
-        depth = tchisla.solve(current_target, max_depth = max_depth and max_depth - 1)
-        if depth is None:
+        solution = tchisla.solve(current_target, max_depth = max_depth and max_depth - 1, deadline = deadline)
+        if solution is None:
+            if tchisla.interrupted == "deferred":
+                return False
+            if tchisla.interrupted:
+                proven = tchisla.depth_finished + (tchisla.interrupted == "downgraded")
+                output.interrupted(solver_key, tchisla.interrupted, proven)
             depth = max_depth
             continue
-        if solution:
-            print("=" * 20)
-        solution = tchisla.solution_prettyprint(current_target, force_print=True)
-        for string in solution:
-            print(string)
-        print(current_target, "=", tchisla.full_expression(tchisla.target), flush = True)
-        if global_config["verbose"]:
-            print('\007', end='', flush = True)
+        depth = solution.depth
+        output.solution(solver_key, current_target, depth, solution.steps, solution.expression)
     if depth and options.try_wr is not False:
         if not record or record > depth:
-            print('New WR Found!', flush = True)
+            output.new_record()
+    return True
 
-def solve(problem, options):
-    print(problem[0], '#', problem[1], flush = True)
-    general_solver(problem[1], problem[0], options)
+def solve(problem, options, output, portfolio = None):
+    output.problem(problem[0], problem[1])
+    start = time.monotonic()
+    solved = general_solver(problem[1], problem[0], options, output, portfolio)
+    if solved:
+        output.done(time.monotonic() - start)
+    return solved
 
 def parse_problems(problems):
-    problem_list = set()
+    # the specs are only parsed, problems are generated lazily by digit, then by
+    # target, without duplicates
+    specs = []
     for each in problems:
         m = problems_re.match(each)
         if not m:
             continue
 
         targets = m.group('targets')
-        targets = parse_targets(targets) if targets else [to_number(m.group('target'))]
+        targets = parse_targets(targets) if targets else [(to_number(m.group('target')),)]
 
         digits = m.group('digits')
         digit = m.group('digit')
         digits = parse_digits(digits) if digits else [int(digit)] if digit else list(range(1, 10))
 
-        for target in targets:
-            for digit in digits:
-                problem_list.add((target, digit))
-    problem_list = sorted(problem_list, key=lambda x: (x[1], x[0]))
+        specs.append((targets, digits))
 
-    return problem_list
+    for digit in range(1, 10):
+        last = None
+        for target in heapq.merge(*(each for targets, digits in specs if digit in digits for each in targets)):
+            if target != last:
+                yield target, digit
+                last = target
 
 def to_number(string):
     number = Fraction(string)
@@ -110,7 +246,8 @@ def parse_digits(digits):
 
 
 def parse_targets(targets):
-    target_list = set()
+    # sorted iterables of targets, ranges are not expanded
+    target_list = []
     targets = targets.split(',')
     for each in targets:
         m = targets_re.match(each)
@@ -118,14 +255,13 @@ def parse_targets(targets):
             continue
         target = m.group('target')
         if target:
-            target_list.add(to_number(target))
+            target_list.append((to_number(target),))
             continue
         start = int(m.group('start'))
         end = int(m.group('end'))
         if start > end:
             start, end = end, start
-        target_list = target_list | set(range(start, end + 1))
-    target_list = sorted(target_list)
+        target_list.append(range(start, end + 1))
     return target_list
 
 def fetchRecord(target, digit):
@@ -159,22 +295,136 @@ def main():
         const='0',
         help='switch mode to try to find a solution shorter than the current WR',
     )
+    parser.add_argument('-t', '--timeout',
+        type=float,
+        help='time limit in seconds for each problem, shared by all solvers'
+    )
+    parser.add_argument('--max-pairs',
+        type=int,
+        help='admission limit on the estimated number of pairs of a depth'
+    )
+    parser.add_argument('--max-memory',
+        type=float,
+        help='admission limit on the estimated memory of a depth, in MiB'
+    )
+    parser.add_argument('--max-time',
+        type=float,
+        help='admission limit on the estimated time of a depth, in seconds'
+    )
+    parser.add_argument('--admission',
+        choices=['refuse', 'downgrade', 'defer'],
+        default='refuse',
+        help='what to do with a depth exceeding the admission limits: give up, search it for the target only, or retry the problem without limits after the others'
+    )
+    parser.add_argument('-b', '--beam',
+        type=int,
+        metavar='WIDTH',
+        help='run an approximate beam search keeping WIDTH values per depth first, its result bounds the depth of the exact search'
+    )
+    parser.add_argument('-p', '--portfolio',
+        action='store_true',
+        default=False,
+        help='run the solvers at the same time in separate processes, stopping each one when another found a solution it cannot beat'
+    )
+    parser.add_argument('--sorted-layers',
+        action='store_true',
+        default=False,
+        help='iterate layers sorted by magnitude, skipping pairs out of range early'
+    )
+    parser.add_argument('--fused',
+        action='append',
+        choices=list(solvers.keys()),
+        default=[],
+        metavar='SOLVER',
+        help='expand the layers of SOLVER with its specialized loop, can be given once per solver'
+    )
+    parser.add_argument('--target-pass',
+        action='store_true',
+        default=False,
+        help='before expanding a depth, find the target if add, subtract, multiply or divide reach it'
+    )
+    parser.add_argument('--prune',
+        action='store_true',
+        default=False,
+        help='with a depth bound (-d, -w or -c), drop the values of the last depths that cannot reach the target within the remaining digits, best for a single problem'
+    )
+    parser.add_argument('-j', '--threads',
+        type=int,
+        default=1,
+        help='threads expanding each depth, on free-threaded Python builds only, otherwise the expansion stays sequential'
+    )
+    parser.add_argument('--processes',
+        type=int,
+        default=1,
+        help='worker processes expanding each depth, the finished layers are shared with them through shared memory'
+    )
+    parser.add_argument('-l', '--limits-profile',
+        metavar='FILE',
+        help='load per-digit solver limits from FILE, as written by tune.py'
+    )
+    parser.add_argument('--memory-report',
+        metavar='FILE',
+        help='write per-depth memory accounting as JSON lines to FILE ("-" for stderr), tracing allocations with tracemalloc'
+    )
     parser.add_argument('-v', '--verbose',
         action='store_true',
         default=False,
         help='enable detailed output'
     )
+    parser.add_argument('-f', '--file',
+        metavar='FILE',
+        help='read more problems from FILE ("-" for stdin), separated by whitespace'
+    )
+    parser.add_argument('--format',
+        choices=['text', 'jsonl'],
+        default='text',
+        help='output format, jsonl writes one record per problem as soon as it is solved'
+    )
     parser.add_argument('problem',
-        nargs='+',
+        nargs='*',
         help='problem to solve, examples: "2", "2#5", "[1,3]#8", "[2-4]#[6,7]", "[3-6,125,127]#[2-9]"'
     )
     options = parser.parse_args()
+    if options.file:
+        with sys.stdin if options.file == '-' else open(options.file) as f:
+            options.problem += f.read().split()
+    if not options.problem:
+        parser.error('no problem to solve')
     global_config["verbose"] = options.verbose
+    global_config["sorted_layers"] = options.sorted_layers
+    global_config["target_pass"] = options.target_pass
+    global_config["budget_pruning"] = options.prune
+    global_config["fused"] = options.fused
+    global_config["threads"] = options.threads
+    global_config["processes"] = options.processes
+    global_config["limits_profile"] = options.limits_profile
+    if options.memory_report:
+        global_config["memory_report"] = sys.stderr if options.memory_report == '-' else open(options.memory_report, 'w')
+        accounting.start_tracing()
+    admission = global_config["admission"]
+    admission["max_pairs"] = options.max_pairs
+    admission["max_memory"] = options.max_memory and options.max_memory * (1 << 20)
+    admission["max_time"] = options.max_time
+    admission["policy"] = options.admission
     if not options.solvers:
         options.solvers=default_solvers
     problem_list = parse_problems(options.problem)
-    for problem in problem_list:
-        solve(problem, options)
+    output = JsonOutput(sys.stdout) if options.format == 'jsonl' else TextOutput(options.admission == 'defer')
+    portfolio = None
+    if options.portfolio:
+        portfolio = Portfolio({key: solvers[key]["solver"] for key in options.solvers})
+    deferred = [problem for problem in problem_list if not solve(problem, options, output, portfolio)]
+    if deferred:
+        for key in ("max_pairs", "max_values", "max_memory", "max_time"):
+            admission[key] = None
+        if portfolio is not None:
+            # the workers have their own copy of the admission limits
+            portfolio.close()
+            portfolio = Portfolio({key: solvers[key]["solver"] for key in options.solvers})
+        for problem in deferred:
+            solve(problem, options, output, portfolio)
+    if portfolio is not None:
+        portfolio.close()
 
 if __name__ == "__main__":
     main()
@@ -313,7 +313,9 @@ class Quadratic(numbers.Real):
         return x.rational_part != 0
 
     def __reduce__(self):
-        return (self.__class__, (str(self),))
+        # codec imports this module
+        from codec import dumps, loads
+        return (loads, (dumps(self),))
 
     def __copy__(self):
         if type(self) is Quadratic:
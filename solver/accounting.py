@@ -0,0 +1,78 @@
+import sys, json, resource, tracemalloc
+from expression import Expression
+from quadratic import Quadratic
+
+__all__ = ["start_tracing", "reset_peak", "layer_report", "write_report"]
+
+def start_tracing():
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+def reset_peak():
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+
+def value_bytes(x, seen):
+    size = sys.getsizeof(x)
+    if type(x) is Quadratic:
+        size += sys.getsizeof(x.rational_part)
+        if x.quadratic_part is not None and id(x.quadratic_part) not in seen:
+            seen.add(id(x.quadratic_part))
+            size += sys.getsizeof(x.quadratic_part)
+    return size
+
+def expression_bytes(expression, seen):
+    # leaves are values of earlier layers, they are counted there
+    size = 0
+    stack = [expression]
+    while stack:
+        expression = stack.pop()
+        if type(expression) is not Expression or id(expression) in seen:
+            continue
+        seen.add(id(expression))
+        size += sys.getsizeof(expression) + sys.getsizeof(expression.args)
+        stack.extend(expression.args)
+    return size
+
+def layer_report(tchisla, digits):
+    layer = tchisla.visited[digits]
+    solutions = tchisla.solutions
+    seen = set()
+    values = expressions = entries = 0
+    for x in layer:
+        entry = solutions[x]
+        values += value_bytes(x, seen)
+        # canonical entries also hold the expression of 1 / x
+        for expression in entry[1:]:
+            expressions += expression_bytes(expression, seen)
+        entries += sys.getsizeof(entry)
+    # the dict is shared by all depths, each value gets its share of the table
+    index = entries + sys.getsizeof(layer) + sys.getsizeof(solutions) * len(layer) // max(len(solutions), 1)
+    if digits in tchisla.sorted_visited:
+        index += sum(map(sys.getsizeof, tchisla.sorted_visited[digits]))
+    traced = None
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        traced = {"current": current, "peak": peak}
+    stats = tchisla.stats.get(digits, {})
+    return {
+        "solver": tchisla.name(),
+        "n": tchisla.n,
+        "depth": digits,
+        "values": len(layer),
+        "total_values": len(solutions),
+        "bytes": {
+            "values": values,
+            "expressions": expressions,
+            "index": index,
+            "total": values + expressions + index
+        },
+        "traced": traced,
+        # ru_maxrss is in KiB on Linux
+        "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss << 10,
+        "pairs": stats.get("pairs"),
+        "time": stats.get("time")
+    }
+
+def write_report(report, file):
+    print(json.dumps(report), file = file, flush = True)
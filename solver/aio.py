@@ -0,0 +1,76 @@
+import asyncio, time
+from functools import partial
+
+__all__ = ["AsyncSolver"]
+
+# solving from asyncio code, the search runs in an executor so the event loop
+# keeps running. Queries for a digit share one warm detached instance, they
+# run one at a time under its asyncio.Lock
+class AsyncSolver:
+    __slots__ = ("solver", "executor", "instances")
+
+    def __init__(self, solver, executor = None):
+        self.solver = solver
+        self.executor = executor
+        self.instances = {}
+
+    def instance(self, n):
+        if n not in self.instances:
+            self.instances[n] = self.solver.detached(n), asyncio.Lock()
+        return self.instances[n]
+
+    @staticmethod
+    def event(tchisla, depth, start):
+        return {
+            "depth": depth,
+            "values": len(tchisla.visited[depth]) if depth < len(tchisla.visited) else 0,
+            "elapsed": time.monotonic() - start,
+            "found": False,
+            "interrupted": False
+        }
+
+    async def events(self, n, target, *, max_depth = None, timeout = None):
+        # one event per searched depth, the last one has the solution or the
+        # reason of the interruption. Cancelling the consuming task cancels
+        # the search, the instance stays usable
+        tchisla, lock = self.instance(n)
+        loop = asyncio.get_running_loop()
+        async with lock:
+            tchisla.__init__(n)
+            start = time.monotonic()
+            deadline = None if timeout is None else start + timeout
+            # events of the depths searched, posted from the executor thread,
+            # None once the search is over
+            queue = asyncio.Queue()
+            def on_depth(depth):
+                loop.call_soon_threadsafe(queue.put_nowait, self.event(tchisla, depth, start))
+            future = loop.run_in_executor(self.executor, partial(tchisla.solve, target, max_depth = max_depth, deadline = deadline, on_depth = on_depth))
+            future.add_done_callback(lambda _: queue.put_nowait(None))
+            try:
+                while (event := await queue.get()) is not None:
+                    yield event
+                found = future.result()
+            finally:
+                # a solve not started yet clears the flag when it starts, cancel again
+                while not future.done():
+                    tchisla.cancel()
+                    await asyncio.wait((future,), timeout = 0.1)
+                # the search may have finished before seeing the flag
+                tchisla.cancelled = False
+            if found is not None:
+                event = self.event(tchisla, found.depth, start)
+                event["found"] = True
+                event["solution"] = found.steps
+                event["expression"] = str(found.expression)
+                yield event
+            elif tchisla.interrupted:
+                event = self.event(tchisla, tchisla.depth_finished + 1, start)
+                event["interrupted"] = tchisla.interrupted
+                yield event
+
+    async def solve(self, n, target, **kwargs):
+        # the last event of the query
+        event = None
+        async for event in self.events(n, target, **kwargs):
+            pass
+        return event
@@ -1,64 +1,142 @@
-import math, sys, copy
+import math, sys, copy, time, threading, multiprocessing
 import operator
-from itertools import count, product, combinations_with_replacement, chain
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import count, chain, islice
 from functools import reduce
 from abc import ABCMeta, abstractmethod
-from config import global_config, specials, limits
-from gmpy2 import mpq as Fraction, fac as factorial
+from config import global_config, specials, limits, load_limits_profile
+from gmpy2 import mpq as Fraction, fac as factorial, iroot
 from expression import Expression
+from solver.layers import LayerStore
+from solver import accounting, threads, shared
 
-__all__ = ["BaseTchisla"]
+__all__ = ["BaseTchisla", "Solution"]
 
 class SolutionFoundError(Exception):
     def __init__(self, message):
         self.message = message
 
+class SearchInterruptedError(Exception):
+    def __init__(self, message):
+        self.message = message
+
+# a solution as read by solve under the lock of the instance, which may be
+# solving another problem by the time it is printed
+class Solution:
+    __slots__ = ("depth", "steps", "expression")
+
+    def __init__(self, depth, steps, expression):
+        self.depth = depth
+        # the lines of solution_prettyprint
+        self.steps = steps
+        self.expression = expression
+
+# shared instances by solver name and digit, only the last digit asked for is kept
+class Registry:
+    __slots__ = ("lock", "instances", "last_digit")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.instances = {}
+        self.last_digit = 0
+
+    def get(self, cls, n):
+        with self.lock:
+            instances = self.instances.setdefault(cls.name(), {})
+            if n not in instances:
+                instances[n] = cls.create()
+            if self.last_digit != 0 and self.last_digit != n:
+                for x in self.instances.values():
+                    x.pop(self.last_digit, None)
+            self.last_digit = n
+            return instances[n]
+
 class BaseTchisla(metaclass=ABCMeta):
-    instances = {}
-    last_digit = 0
-    __slots__ = ("n", "target", "solutions", "max_depth", "visited", "number_printed", "specials", "limits", "depth_started", "depth_finished", "start_state")
+    registry = Registry()
+    # pairs evaluated between two deadline / cancellation checks, minus one
+    interrupt_mask = 0x3ff
+    # bytes taken by a solutions entry and a visited slot besides the objects
+    container_size = 64
+    # values are totally ordered, layers can be iterated sorted by magnitude
+    ordered = False
+    # most remaining digits a bounded search prunes a depth for
+    budget_limit = 3
+    __slots__ = ("n", "target", "solutions", "max_depth", "visited", "layers", "number_printed", "specials", "limits", "depth_finished", "expansion", "pairs", "deadline", "bound", "cancelled", "interrupted", "stats", "scratch", "sorted_visited", "lock", "shared", "integer_indexes", "odd_indexes", "limit_indexes", "pruned", "reachable_sets")
 
     def __new__(cls, n):
-        class_name = cls.name()
-        if class_name not in cls.instances:
-            cls.instances[class_name] = {}
-        if n not in cls.instances[class_name]:
-            instance = super(BaseTchisla, cls).__new__(cls)
-            instance.solutions = {}
-            instance.visited = [None, []]
-            instance.depth_started = 0
-            instance.depth_finished = 0
-            instance.start_state = []
-            cls.instances[class_name][n] = instance
-        if cls.last_digit != 0 and cls.last_digit != n:
-            for x in cls.instances:
-                if cls.last_digit in cls.instances[x]:
-                    del cls.instances[x][cls.last_digit]
-        cls.last_digit = n
-
-        return cls.instances[class_name][n]
+        return cls.registry.get(cls, n)
+
+    @classmethod
+    def create(cls):
+        instance = super(BaseTchisla, cls).__new__(cls)
+        instance.layers = LayerStore(instance.new_layer)
+        instance.solutions = instance.layers.solutions
+        instance.visited = instance.layers.visited
+        instance.depth_finished = 0
+        instance.expansion = None
+        instance.pairs = 0
+        instance.cancelled = False
+        instance.stats = {}
+        instance.scratch = None
+        instance.sorted_visited = {}
+        instance.integer_indexes = {}
+        instance.odd_indexes = {}
+        instance.limit_indexes = {}
+        # first depth pruned for the target of the last bounded solve, if any
+        instance.pruned = None
+        instance.reachable_sets = []
+        # held by __init__ and solve, which returns the solution read under it.
+        # Callers sharing the instance between threads hold it around a solve and
+        # the reading of interrupted or depth_finished
+        instance.lock = threading.RLock()
+        # finished layers published in shared memory for worker processes
+        instance.shared = None
+        return instance
+
+    @classmethod
+    def detached(cls, n):
+        # an instance outside of the shared cache, with its own layers
+        instance = cls.create()
+        instance.__init__(n)
+        return instance
 
     def __init__(self, n):
-        self.n = n
-        self.target = None
-        self.max_depth = None
-        self.number_printed = set()
-
-        self.specials = {}
-        if n in specials[self.name()]:
-            self.specials = specials[self.name()][n]
-
-        self.limits = copy.deepcopy(limits[self.name()]["default"])
-        if n in limits[self.name()]:
-            self.limits.update(limits[self.name()][n])
+        with self.lock:
+            self.n = n
+            self.target = None
+            self.max_depth = None
+            self.deadline = None
+            self.bound = None
+            self.interrupted = False
+            self.number_printed = set()
+
+            self.specials = {}
+            if n in specials[self.name()]:
+                self.specials = specials[self.name()][n]
+
+            self.limits = copy.deepcopy(limits[self.name()]["default"])
+            if n in limits[self.name()]:
+                self.limits.update(limits[self.name()][n])
+            if global_config["limits_profile"]:
+                profile = load_limits_profile(global_config["limits_profile"])
+                self.limits.update(profile.get(self.name(), {}).get(str(n), {}))
         self.MAX = self.limits["max"]
         self.MAX_DIGITS = self.limits["max_digits"]
         self.MAX_CONCAT = self.limits["max_concat"]
         self.MAX_FACTORIAL = self.limits["max_factorial"]
 
-    def insert(self, x, digits, expression):
-        self.solutions[x] = digits, expression
-        self.visited[digits].append(x)
+    # candidates carry a builder and its operands, the expression is only
+    # built for the values actually inserted
+    def insert(self, x, digits, op, p, q = None):
+        self.store(x, digits, op(p) if q is None else op(p, q))
+
+    def store(self, x, digits, expression):
+        if self.scratch is None:
+            self.layers.add(x, digits, expression)
+        else:
+            self.solutions[x] = digits, expression
+            self.scratch.append((x, digits))
         if x == self.target:
             raise SolutionFoundError((x, digits))
 
@@ -67,6 +145,9 @@ class BaseTchisla(metaclass=ABCMeta):
     def name():
         pass
 
+    def new_layer(self):
+        return []
+
     @abstractmethod
     def range_check(self, x):
         pass
@@ -75,10 +156,10 @@ class BaseTchisla(metaclass=ABCMeta):
     def integer_check(self, x):
         pass
 
-    def check(self, x, digits, expression, *, need_sqrt = True):
+    def check(self, x, digits, op, p, q = None, *, need_sqrt = True):
         if not self.range_check(x) or x in self.solutions:
             return
-        self.insert(x, digits, expression)
+        self.insert(x, digits, op, p, q)
         if need_sqrt:
             self.sqrt(x, digits)
         if self.integer_check(x):
@@ -87,31 +168,35 @@ class BaseTchisla(metaclass=ABCMeta):
     def concat(self, digits):
         if digits <= self.MAX_CONCAT:
             x = self.constructor((10 ** digits - 1) // 9 * self.n)
-            self.check(x, digits, Expression.concat(x))
+            self.check(x, digits, Expression.concat, x)
 
     def add(self, p, q, digits):
-        self.check(p + q, digits, Expression.add(p, q))
+        self.check(p + q, digits, Expression.add, p, q)
 
     def subtract(self, p, q, digits):
         if p == q:
             return
         result = p - q
         if result < 0:
-            self.check(-result, digits, Expression.subtract(q, p))
+            self.check(-result, digits, Expression.subtract, q, p)
         else:
-            self.check(result, digits, Expression.subtract(p, q))
+            self.check(result, digits, Expression.subtract, p, q)
 
     def multiply(self, p, q, digits):
-        self.check(p * q, digits, Expression.multiply(p, q))
+        self.check(p * q, digits, Expression.multiply, p, q)
 
     def divide(self, p, q, digits):
         quotient = p / q
         if quotient < 1:
-            self.check(quotient ** -1, digits, Expression.divide(q, p))
-            self.check(quotient, digits, Expression.divide(p, q))
+            self.check(quotient ** -1, digits, Expression.divide, q, p)
+            self.check(quotient, digits, Expression.divide, p, q)
         else:
-            self.check(quotient, digits, Expression.divide(p, q))
-            self.check(quotient ** -1, digits, Expression.divide(q, p))
+            self.check(quotient, digits, Expression.divide, p, q)
+            self.check(quotient ** -1, digits, Expression.divide, q, p)
+
+    def integer_value(self, x):
+        # x as an int, x being an integer
+        return int(x)
 
     def factorial_divide(self, p, q, digits):
         if p == q or not self.integer_check(p) or not self.integer_check(q):
@@ -126,29 +211,15 @@ class BaseTchisla(metaclass=ABCMeta):
         ):
             return
         result = reduce(operator.mul, range(x, y, -1))
-        p_factorial = Expression.factorial(p)
-        q_factorial = Expression.factorial(q)
-        self.check(self.constructor(result), digits, Expression.divide(p_factorial, q_factorial))
+        self.check(self.constructor(result), digits, Expression.factorial_quotient, p, q)
         if digits == self.max_depth:
             return
         if self.solutions[q][0] == 1:
-            self.check(self.constructor(result - 1), digits + 1, Expression.divide(
-                Expression.subtract(p_factorial, q_factorial),
-                q_factorial
-            ))
-            self.check(self.constructor(result + 1), digits + 1, Expression.divide(
-                Expression.add(p_factorial, q_factorial),
-                q_factorial
-            ))
-            self.check(self.constructor(result >> 1), digits + 1, Expression.divide(
-                p_factorial,
-                Expression.add(q_factorial, q_factorial)
-            ))
+            self.check(self.constructor(result - 1), digits + 1, Expression.factorial_quotient_minus_one, p, q)
+            self.check(self.constructor(result + 1), digits + 1, Expression.factorial_quotient_plus_one, p, q)
+            self.check(self.constructor(result >> 1), digits + 1, Expression.factorial_quotient_half, p, q)
         if self.solutions[p][0] == 1:
-            self.check(self.constructor(result << 1), digits + 1, Expression.divide(
-                Expression.add(p_factorial, p_factorial),
-                q_factorial
-            ))
+            self.check(self.constructor(result << 1), digits + 1, Expression.factorial_quotient_double, p, q)
 
     @abstractmethod
     def exponent(self, p, q, digits):
@@ -161,74 +232,637 @@ class BaseTchisla(metaclass=ABCMeta):
     def factorial(self, x, digits):
         if int(x) <= self.MAX_FACTORIAL:
             y = self.constructor(factorial(int(x)))
-            self.check(y, digits, Expression.factorial(x))
+            self.check(y, digits, Expression.factorial, x)
 
-    def binary_operation(self, p, q, digits):
+    def binary_operation(self, p, q, powers, digits):
         self.add(p, q, digits)
         self.subtract(p, q, digits)
         self.multiply(p, q, digits)
         self.divide(p, q, digits)
-        self.exponent(p, q, digits)
-        self.exponent(q, p, digits)
+        if powers & 1:
+            self.exponent(p, q, digits)
+        if powers & 2:
+            self.exponent(q, p, digits)
 
     def binary_generator(self, digits):
-        for d1 in range(1, (digits + 1) >> 1):
+        for d1 in range(1, (digits >> 1) + 1):
+            yield from self.row_generator(d1, 0, len(self.visited[d1]), digits)
+
+    def row_generator(self, d1, start, stop, digits):
+        # the pairs of binary_generator whose first value is visited[d1][start:stop],
+        # with the exponents that may give something (1 for p ** q, 2 for q ** p)
+        d2 = digits - d1
+        first, second, limits = self.visited[d1], self.visited[d2], self.exponent_limits(d2)
+        for index in range(start, stop):
+            offset = index if d1 == d2 else 0
+            p = first[index]
+            p_exponents, p_odd = self.exponent_row(p, d2)
+            for q, limit in zip(islice(second, offset, None), islice(limits, offset, None)):
+                yield p, q, (q in p_exponents) | (0 < p_odd <= limit) << 1
+
+    def integer_index(self, digits):
+        # finished layers only, the integers sorted by value with their position
+        layer = self.visited[digits]
+        if digits not in self.integer_indexes or self.integer_indexes[digits][0] != len(layer):
+            integers = sorted(
+                (self.integer_value(x), position) for position, x in enumerate(layer) if self.integer_check(x)
+            )
+            self.integer_indexes[digits] = len(layer), [x for x, _ in integers], [position for _, position in integers]
+        return self.integer_indexes[digits][1:]
+
+    def factorial_rows(self, d1, start, stop, digits):
+        # the pairs of binary_generator whose first value is visited[d1][start:stop] and
+        # factorial_divide may act on. It needs y > 2 and (x - y) * (log2(x) + log2(y))
+        # <= 2 * MAX_DIGITS for x > y, hence |x - y| <= 2 * MAX_DIGITS / (log2(p) + log2(3)),
+        # the other value is in a window of the sorted integers of the other layer
+        d2 = digits - d1
+        first, second = self.visited[d1], self.visited[d2]
+        values, positions = self.integer_index(d2)
+        if not values:
+            return
+        integer_check, integer_value = self.integer_check, self.integer_value
+        bound = self.MAX_DIGITS << 1
+        log3 = math.log2(3)
+        for index in range(start, stop):
+            p = first[index]
+            if not integer_check(p):
+                continue
+            x = integer_value(p)
+            if x < 3:
+                continue
+            # slack for rounding, factorial_divide checks again
+            width = bound / (math.log2(x) + log3) + 1
+            lo, hi = bisect_left(values, x - width), bisect_right(values, x + width)
+            if lo == hi:
+                continue
+            offset = index if d1 == d2 else 0
+            for position in sorted(positions[lo:hi]):
+                if position >= offset:
+                    yield p, second[position]
+
+    def factorial_generator(self, digits):
+        # the pairs of binary_generator factorial_divide may act on, in the same order
+        for d1 in range(1, (digits >> 1) + 1):
+            yield from self.factorial_rows(d1, 0, len(self.visited[d1]), digits)
+
+    def odd_index(self, digits):
+        # finished layers only, the integers of a layer by the odd part of their value:
+        # exponent(p, q) only gives something if log2(p) * odd(q) <= MAX_DIGITS
+        layer = self.visited[digits]
+        if digits not in self.odd_indexes or self.odd_indexes[digits][0] != len(layer):
+            integers = []
+            for x in layer:
+                if self.integer_check(x):
+                    value = self.integer_value(x)
+                    integers.append((value // (value & -value), x))
+            integers.sort(key = lambda entry: entry[0])
+            self.odd_indexes[digits] = len(layer), [odd for odd, _ in integers], [x for _, x in integers], {}
+        return self.odd_indexes[digits][1:]
+
+    def exponents(self, digits, limit):
+        # the integers of a layer with an odd part up to limit
+        odds, values, cache = self.odd_index(digits)
+        count = bisect_right(odds, limit)
+        if count not in cache:
+            cache[count] = frozenset(values[:count])
+        return cache[count]
+
+    def exponent_limit(self, x):
+        # the largest odd part of an exponent q with x ** q in range, with some slack
+        # for rounding, 0 if there is none
+        height = self.log_height(x)
+        return self.MAX_DIGITS * math.log(2) / height + 1 if height else 0
+
+    def exponent_limits(self, digits):
+        # finished layers only, the exponent limit of each value as a base
+        layer = self.visited[digits]
+        if digits not in self.limit_indexes or len(self.limit_indexes[digits]) != len(layer):
+            self.limit_indexes[digits] = array("d", map(self.exponent_limit, layer))
+        return self.limit_indexes[digits]
+
+    def exponent_row(self, p, digits):
+        # the values of a finished layer p ** q may be built from, and the odd part
+        # of p as an exponent (0 if it is not an integer), q ** p only gives
+        # something for the values q whose exponent limit is at least that
+        p_exponents = self.exponents(digits, self.exponent_limit(p))
+        if not self.integer_check(p):
+            return p_exponents, 0
+        value = self.integer_value(p)
+        return p_exponents, value // (value & -value)
+
+    def expand(self, digits):
+        for p, q, powers in self.binary_generator(digits):
+            self.binary_operation(p, q, powers, digits)
+            yield
+        for p, q in self.factorial_generator(digits):
+            self.factorial_divide(p, q, digits)
+            yield
+
+    def expand_fused(self, digits):
+        # expand with add / subtract / multiply / divide and their range check and
+        # dedupe inlined, the rare candidates kept are inserted by fused_insert without
+        # going through check, and exponent only called for the pairs whose exponent
+        # may fit. Solvers without a specialized loop of their own use expand
+        return self.expand(digits)
+
+    def shared_layout(self):
+        # how values are written to shared memory, None if they cannot be
+        return None
+
+    def fused_insert(self, digits):
+        # insert / store and the sqrt / factorial chains of check as a single local
+        # function, for candidates already known to be in range and new. The target
+        # is read on each insert, an interrupted expansion resumes for the next one
+        solutions, layer, scratch = self.solutions, self.visited[digits], self.scratch
+        sqrt, factorial, integer_check = self.sqrt, self.factorial, self.integer_check
+        def insert(x, expression):
+            solutions[x] = digits, expression
+            if scratch is None:
+                layer.append(x)
+            else:
+                scratch.append((x, digits))
+            if x == self.target:
+                raise SolutionFoundError((x, digits))
+            sqrt(x, digits)
+            if integer_check(x):
+                factorial(x, digits)
+        return insert
+
+    def target_operands(self, p):
+        # (op, q) such that op(p, q) may give the target
+        target = self.target
+        return (
+            (self.add, target - p),
+            (self.subtract, p - target),
+            (self.subtract, p + target),
+            (self.multiply, target / p),
+            (self.divide, p / target),
+            (self.divide, p * target)
+        )
+
+    def target_pass(self, digits):
+        # add / subtract / multiply / divide only give the target from a value and one
+        # of its target operands, a lookup for each value of the smaller layer of
+        # every pair of depths finds it before any pair is expanded
+        for d1 in range(1, (digits >> 1) + 1):
+            d2 = digits - d1
+            if len(self.visited[d2]) < len(self.visited[d1]):
+                d1, d2 = d2, d1
+            for p in self.visited[d1]:
+                for op, q in self.target_operands(p):
+                    if q is None:
+                        continue
+                    key = self.key(q)
+                    if key is not None and self.solutions[key][0] == d2:
+                        op(p, q, digits)
+                yield
+
+    def sorted_layer(self, digits):
+        # only finished layers are sorted, they never change afterwards
+        layer = self.visited[digits]
+        if digits not in self.sorted_visited or len(self.sorted_visited[digits][0]) != len(layer):
+            values = sorted(layer)
+            self.sorted_visited[digits] = values, [x for x in values if self.integer_check(x)]
+        return self.sorted_visited[digits]
+
+    def product_bound(self, p):
+        pass
+
+    def quotient_window(self, p):
+        pass
+
+    def exponent_window(self, q):
+        pass
+
+    def sorted_exponent(self, bases, exponents, digits):
+        for q in exponents:
+            q_int = int(q)
+            lo, hi = self.exponent_window(q_int // (q_int & -q_int))
+            for p in islice(bases, bisect_left(bases, lo), bisect_right(bases, hi)):
+                self.exponent(p, q, digits)
+            yield
+
+    def expand_sorted(self, digits):
+        # same candidates as expand, but add / multiply / divide / exponent
+        # skip the pairs whose result is out of range by magnitude alone
+        for d1 in range(1, (digits >> 1) + 1):
             d2 = digits - d1
-            yield from product(self.visited[d1], self.visited[d2])
+            (first, first_integers), (second, second_integers) = self.sorted_layer(d1), self.sorted_layer(d2)
+            end = len(second)
+            for index, p in enumerate(first):
+                start = index if d1 == d2 else 0
+                for q in islice(second, start, bisect_right(second, self.MAX - p, start)):
+                    self.add(p, q, digits)
+                for q in islice(second, start, end):
+                    self.subtract(p, q, digits)
+                for q in islice(second, start, bisect_right(second, self.product_bound(p), start)):
+                    self.multiply(p, q, digits)
+                window = self.quotient_window(p)
+                if window is None:
+                    quotients = islice(second, start, end)
+                else:
+                    quotients = islice(second, bisect_left(second, window[0], start), bisect_right(second, window[1], start))
+                for q in quotients:
+                    self.divide(p, q, digits)
+                yield
+            yield from self.sorted_exponent(first, second_integers, digits)
+            if d1 != d2:
+                yield from self.sorted_exponent(second, first_integers, digits)
+        for p, q in self.factorial_generator(digits):
+            self.factorial_divide(p, q, digits)
+            yield
+
+    def pair_count(self, digits):
+        pairs = 0
+        for d1 in range(1, (digits + 1) >> 1):
+            pairs += len(self.visited[d1]) * len(self.visited[digits - d1])
         if digits & 1 == 0:
-            yield from combinations_with_replacement(self.visited[digits >> 1], 2)
+            size = len(self.visited[digits >> 1])
+            pairs += size * (size + 1) >> 1
+        return pairs
+
+    def value_size(self, x):
+        entry = self.solutions[x]
+        expression = entry[1]
+        return sys.getsizeof(x) + sys.getsizeof(entry) + sys.getsizeof(expression) + sys.getsizeof(expression.args)
+
+    def estimate(self, digits):
+        # pair count is exact, the rest is extrapolated from the last finished depth
+        estimate = {"depth": digits, "pairs": self.pair_count(digits), "values": None, "memory": None, "time": None}
+        last = max((d for d in self.stats if d < digits and self.stats[d]["pairs"]), default = None)
+        if last is None:
+            return estimate
+        stats = self.stats[last]
+        estimate["values"] = round(estimate["pairs"] * stats["new"] / stats["pairs"])
+        estimate["time"] = estimate["pairs"] * stats["time"] / stats["pairs"]
+        sample = self.visited[last][:256]
+        if sample:
+            size = sum(map(self.value_size, sample)) / len(sample) + self.container_size
+            estimate["memory"] = round(estimate["values"] * size)
+        return estimate
+
+    def admission(self, estimate):
+        config = global_config["admission"]
+        for key in ("pairs", "values", "memory", "time"):
+            limit = config["max_" + key]
+            if limit is not None and estimate[key] is not None and estimate[key] > limit:
+                return config["policy"]
 
     def search(self, digits):
         # if already found, raise it
-        if self.target in self.solutions:
-            solution = self.solutions[self.target]
+        solution = self.entry(self.target)
+        if solution is not None:
             raise SolutionFoundError((self.target, solution[0]))
 
         # no need to search finished depth
         if digits <= self.depth_finished:
             return
 
-        # needs digits + 1 for factorial_divide
-        while len(self.visited) <= digits + 1:
-            self.visited.append([])
-
-        # restart search for the unfinished depth
-        # we need to keep results provided by factorial_divide of last depth
-        if self.depth_started < digits:
-            self.start_state = copy.copy(self.visited[digits])
-            self.depth_started = digits
-        for x in self.visited[digits]:
-            if x not in self.start_state:
-                del self.solutions[x]
-        self.visited[digits] = copy.copy(self.start_state)
-        if digits in self.specials:
-            for (x, expression) in self.specials[digits]:
-                self.insert(x, digits, expression)
-
-        self.concat(digits)
-        for p, q in self.binary_generator(digits):
-            self.binary_operation(p, q, digits)
-        for p, q in self.binary_generator(digits):
-            self.factorial_divide(p, q, digits)
-        self.depth_finished = digits
+        self.interrupt_check(digits)
 
-    def solve(self, target, *, max_depth = None):
-        self.target = self.constructor(target)
-        self.max_depth = max_depth
-        for digits in count(1):
-            if digits - 1 == max_depth:
-                return
+        # an interrupted expansion only holds values of the right depth, resume it
+        if self.expansion is None:
+            estimate = self.estimate(digits)
             if global_config["verbose"]:
-                print(digits, file=sys.stderr, flush = True)
-            try:
-                self.search(digits)
-            except SolutionFoundError as solution:
-                if max_depth is None or solution.message[1] <= max_depth:
-                    return solution.message[1]
-                return
+                print("estimate:", estimate, file=sys.stderr, flush = True)
+            policy = self.admission(estimate)
+            if policy == "refuse":
+                raise SearchInterruptedError(("refused", digits))
+            elif policy == "defer":
+                raise SearchInterruptedError(("deferred", digits))
+
+            # needs digits + 1 for factorial_divide
+            self.layers.layer(digits + 1)
+
+            # restart search for the unfinished depth
+            # we need to keep results provided by factorial_divide of last depth
+            self.layers.mark(digits)
+            self.layers.rollback(digits)
+            self.stats[digits] = {"pairs": estimate["pairs"], "new": len(self.solutions), "time": 0.0}
+            if digits in self.specials:
+                for (x, expression) in self.specials[digits]:
+                    self.store(x, digits, expression)
+            self.concat(digits)
+            if self.ordered and global_config["sorted_layers"]:
+                self.expansion = self.expand_sorted(digits)
+            elif global_config["threads"] > 1 and not threads.gil_enabled():
+                self.expansion = threads.expand(self, digits, global_config["threads"])
+            elif global_config["processes"] > 1 and self.shared_layout() is not None and not multiprocessing.current_process().daemon:
+                # portfolio workers are daemonic and cannot start a process pool
+                self.expansion = shared.expand(self, digits, global_config["processes"])
+            elif self.name() in global_config["fused"]:
+                self.expansion = self.expand_fused(digits)
+            else:
+                self.expansion = self.expand(digits)
+            if global_config["target_pass"]:
+                self.expansion = chain(self.target_pass(digits), self.expansion)
+            self.pairs = 0
+            if global_config["memory_report"]:
+                accounting.reset_peak()
+            if policy == "downgrade":
+                # check candidates against the target only, nothing is kept
+                self.scratch = []
+
+        start_time = time.monotonic()
+        try:
+            if self.scratch is None:
+                for _ in self.expansion:
+                    self.pairs += 1
+                    if self.pairs & self.interrupt_mask == 0:
+                        self.interrupt_check(digits)
+            else:
+                for _ in self.expansion:
+                    for x, _ in self.scratch:
+                        del self.solutions[x]
+                    self.scratch.clear()
+                    self.pairs += 1
+                    if self.pairs & self.interrupt_mask == 0:
+                        self.interrupt_check(digits)
+        except SolutionFoundError:
+            self.expansion = None
+            if self.scratch is not None:
+                # keep the values leading to the target consistent with visited
+                for x, d in self.scratch:
+                    self.visited[d].append(x)
+                self.scratch = None
+            raise
+        except SearchInterruptedError:
+            if self.scratch is not None:
+                # nothing of a downgraded depth is kept, it cannot be resumed
+                for x, _ in self.scratch:
+                    del self.solutions[x]
+                self.expansion = self.scratch = None
+            raise
+        finally:
+            self.stats[digits]["time"] += time.monotonic() - start_time
+        self.expansion = None
+        if self.scratch is not None:
+            self.scratch = None
+            raise SearchInterruptedError(("downgraded", digits))
+        stats = self.stats[digits]
+        stats["new"] = len(self.solutions) - stats["new"]
+        self.depth_finished = digits
+        if global_config["memory_report"]:
+            accounting.write_report(accounting.layer_report(self, digits), global_config["memory_report"])
+
+    def interrupt_check(self, digits):
+        if self.cancelled:
+            raise SearchInterruptedError(("cancelled", digits))
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            raise SearchInterruptedError(("timeout", digits))
+        # depth of a solution found elsewhere (a shared multiprocessing.Value, 0 if none),
+        # this depth cannot improve on it
+        if self.bound is not None and 0 < self.bound.value <= digits:
+            raise SearchInterruptedError(("outrun", digits))
+
+    def cancel(self):
+        # may be called from another thread, the running search stops at its next
+        # check. A solve starting afterwards clears it
+        self.cancelled = True
+
+    def progress(self):
+        digits = self.depth_finished + 1
+        return {
+            "depth_finished": self.depth_finished,
+            "depth": digits,
+            "values": len(self.visited[digits]) if digits < len(self.visited) else 0,
+            "pairs": self.pairs if self.expansion is not None else 0
+        }
+
+    def solve(self, target, *, max_depth = None, timeout = None, deadline = None, bound = None, on_depth = None):
+        # a Solution, None if there is none within max_depth or the search was interrupted.
+        # on_depth(digits) is called once each depth is searched without finding the target
+        with self.lock:
+            self.target = self.constructor(target)
+            self.max_depth = max_depth
+            self.bound = bound
+            if timeout is not None:
+                deadline = min(math.inf if deadline is None else deadline, time.monotonic() + timeout)
+            self.deadline = deadline
+            self.interrupted = False
+            self.cancelled = False
+            if self.pruned is not None:
+                self.restore()
+            self.reachable_sets = []
+            for digits in count(1):
+                if digits - 1 == max_depth:
+                    return
+                if global_config["verbose"]:
+                    print(digits, file=sys.stderr, flush = True)
+                finished = self.depth_finished
+                try:
+                    self.search(digits)
+                except SolutionFoundError as solution:
+                    depth = solution.message[1]
+                    if max_depth is None or depth <= max_depth:
+                        return Solution(
+                            depth,
+                            self.solution_prettyprint(self.target, force_print=True),
+                            self.full_expression(self.target)
+                        )
+                    return
+                except SearchInterruptedError as interruption:
+                    # depth_finished is the deepest depth proven to have no solution,
+                    # or the interrupted depth itself if it was downgraded
+                    self.interrupted = interruption.message[0]
+                    self.cancelled = False
+                    if global_config["verbose"]:
+                        print("interrupted:", self.progress(), file=sys.stderr, flush = True)
+                    return
+                if global_config["budget_pruning"] and digits > finished:
+                    self.prune(digits)
+                if on_depth is not None:
+                    on_depth(digits)
+
+    def rational_value(self, x):
+        # x as a Fraction, for the reachability sets of bounded searches
+        return Fraction(x)
+
+    def admits(self, x):
+        # whether the Fraction x may be a value of the solver
+        return x > 0 and self.range_check(x)
+
+    def operand_values(self, digits):
+        # the values a finished layer stands for, as Fractions
+        return map(self.rational_value, self.visited[digits])
+
+    def unary_preimages(self, x):
+        # the values sqrt and factorial turn into x
+        yield x * x
+        if x.denominator == 1 and x > 2:
+            m, y = 2, 2
+            while y < x and m < self.MAX_FACTORIAL:
+                m += 1
+                y *= m
+            if y == x:
+                yield Fraction(m)
+
+    def factorial_quotient_preimages(self, x, y):
+        # the integers p with p! / y! or y! / p! equal to x
+        if x.denominator != 1 or y.denominator != 1 or x < 2:
+            return
+        x, y = x.numerator, y.numerator
+        p, quotient = y + 1, y + 1
+        while quotient < x:
+            p += 1
+            quotient *= p
+        if quotient == x:
+            yield Fraction(p)
+        p, quotient = y - 1, y
+        while quotient < x and p > 1:
+            quotient *= p
+            p -= 1
+        if quotient == x:
+            yield Fraction(p)
+
+    def binary_preimages(self, x, y):
+        # the values p such that an operation of p and y gives x, exponents being
+        # folded by square roots when out of range, and negative when the solver
+        # has negative powers (x is then the reciprocal of a power)
+        yield x - y
+        yield y - x
+        yield x + y
+        yield x * y
+        yield x / y
+        yield y / x
+        height = max(x.numerator, x.denominator).bit_length()
+        if x != 1:
+            for power in (x, x ** -1):
+                yield from self.power_preimages(power, y, height)
+        yield from self.factorial_quotient_preimages(x, y)
+
+    def power_preimages(self, x, y, height):
+        # the bases p with p ** y equal to x, and the exponents p with y ** p equal to x
+        if y.denominator == 1:
+            # down to x itself, a power of two folded all the way
+            m = y.numerator
+            while True:
+                if m <= height:
+                    numerator, exact = iroot(x.numerator, m)
+                    if exact:
+                        denominator, exact = iroot(x.denominator, m)
+                        if exact:
+                            yield Fraction(numerator, denominator)
+                if m & 1:
+                    break
+                m >>= 1
+        if y != 1:
+            m = round((math.log(x.numerator) - math.log(x.denominator)) / (math.log(y.numerator) - math.log(y.denominator)))
+            if 0 < m <= height and y ** m == x:
+                p = Fraction(m)
+                while self.admits(p):
+                    yield p
+                    p *= 2
+
+    def reachable(self, budget, limit):
+        # the Fractions an expression of the target can be built from with at most
+        # budget more digits, None if there are more than limit of them. The
+        # layers of up to budget digits are finished, and kept whole
+        sets = self.reachable_sets
+        if sets and sets[-1] is None:
+            # too many for a smaller layer, tried again
+            sets.pop()
+        if not sets:
+            sets.append(self.unary_closure({self.rational_value(self.target)}, limit))
+        while len(sets) <= budget and sets[-1] is not None:
+            k = len(sets)
+            values = set(sets[-1])
+            for e in range(1, k + 1):
+                operands = list(self.operand_values(e))
+                for x in sets[k - e]:
+                    for y in operands:
+                        values.update(self.binary_preimages(x, y))
+                # factorial quotients with one more digit for - 1, + 1, / 2 or * 2
+                if e < k:
+                    for x in sets[k - e - 1]:
+                        for quotient in (x - 1, x + 1, x * 2, x * 2 + 1, x / 2):
+                            for y in operands:
+                                values.update(self.factorial_quotient_preimages(quotient, y))
+                if len(values) > limit << 2:
+                    values = None
+                    break
+            sets.append(values and self.unary_closure({x for x in values if self.admits(x)}, limit))
+        return sets[budget] if budget < len(sets) else None
+
+    def unary_closure(self, values, limit):
+        stack = list(values)
+        while stack:
+            if len(values) > limit:
+                return None
+            for x in self.unary_preimages(stack.pop()):
+                if x not in values and self.admits(x):
+                    values.add(x)
+                    stack.append(x)
+        return values
+
+    def with_dependencies(self, digits, keep):
+        # adds to keep the values of the same depth the kept ones are built from
+        # (sqrt and factorial chains)
+        solutions = self.solutions
+        stack = list(keep)
+        while stack:
+            leaves = list(solutions[stack.pop()][1:])
+            while leaves:
+                leaf = leaves.pop()
+                if type(leaf) is Expression:
+                    leaves.extend(leaf.args)
+                    continue
+                key = self.key(leaf)
+                if key is not None and key not in keep and solutions[key][0] == digits:
+                    keep.add(key)
+                    stack.append(key)
+
+    def prune(self, digits):
+        # in a bounded search, the values of a finished depth that no expression of
+        # the target with the remaining digits can use are dropped. Only the depths
+        # whose remaining digits are fewer than their own are pruned, the smaller
+        # layers the reachable values are built from stay whole
+        budget = self.max_depth - digits if self.max_depth is not None else 0
+        if not 0 < budget < min(digits, self.budget_limit + 1):
+            return
+        layer = self.visited[digits]
+        reachable = self.reachable(budget, len(layer))
+        if reachable is None:
+            return
+        reachable = set(map(self.constructor, reachable))
+        # values carried over from factorial_divide of the previous depth stay, restore
+        # only searches this depth again
+        keep = set(islice(layer, self.layers.marks.get(digits, 0)))
+        keep.update(x for x in layer if x in reachable)
+        self.with_dependencies(digits, keep)
+        if len(keep) < len(layer):
+            self.layers.retain(digits, keep)
+            if self.pruned is None:
+                self.pruned = digits
+
+    def restore(self):
+        # the layers from the first pruned depth are searched again
+        digits, self.pruned = self.pruned, None
+        self.expansion = None
+        for d in range(digits + 1, len(self.visited)):
+            self.layers.discard(d)
+        self.layers.rollback(digits)
+        self.depth_finished = min(self.depth_finished, digits - 1)
+        self.forget(digits)
+
+    def forget(self, digits):
+        # indexes of the layers from digits on, which are searched again
+        for indexes in (self.sorted_visited, self.integer_indexes, self.odd_indexes, self.limit_indexes):
+            for d in [d for d in indexes if d >= digits]:
+                del indexes[d]
+        if self.shared is not None:
+            self.shared.release()
+
+    # the key a value is stored under, None if it is not known
+    def key(self, x):
+        return x if x in self.solutions else None
+
+    # (digits, expression) of a value, None if it is not known
+    def entry(self, x):
+        return self.solutions.get(x)
 
     def printer(self, n):
-        digits, expression = self.solutions[n]
+        digits, expression = self.entry(n)
         string = str(digits) + ": " + str(n)
         if expression.name == "concat":
             return string
@@ -242,9 +876,9 @@ class BaseTchisla(metaclass=ABCMeta):
             else:
                 return (expression,)
 
-        if n in self.number_printed or n not in self.solutions:
+        if n in self.number_printed or self.key(n) is None:
             return []
-        digits, expression = self.solutions[n]
+        digits, expression = self.entry(n)
         if expression.name == "concat" and not force_print:
             return []
         solution_list = [self.printer(n)]
@@ -256,7 +890,7 @@ class BaseTchisla(metaclass=ABCMeta):
     def full_expression(self, n):
         if type(n) is Expression:
             return Expression(n.name, *map(self.full_expression, n.args))
-        _, expression = self.solutions[n]
+        _, expression = self.entry(n)
         if expression.name == "concat":
             return n
         else:
@@ -0,0 +1,55 @@
+import heapq
+from itertools import count
+from solver.base import SolutionFoundError, SearchInterruptedError
+
+__all__ = ["BeamSearch"]
+
+# approximate search keeping at most width values per depth, on a detached
+# solver instance, the depth found is an upper bound of the optimal one
+class BeamSearch:
+    __slots__ = ("tchisla", "width", "target_log", "interrupted")
+
+    def __init__(self, solver, n, width):
+        self.tchisla = solver.detached(n)
+        self.width = width
+        self.target_log = None
+        self.interrupted = False
+
+    def score(self, x):
+        # closeness to the target in log space, penalizing big denominators
+        # (log_height - |log_value| is the log of the smaller of both parts)
+        value = self.tchisla.log_value(x)
+        return abs(value - self.target_log) + (self.tchisla.log_height(x) - abs(value)) / 4
+
+    def prune(self, digits):
+        layer = self.tchisla.visited[digits]
+        if len(layer) <= self.width:
+            return
+        # half of the beam goes to the values closest to the target, the rest
+        # to the simplest ones, which are the building blocks of later depths
+        keep = set(heapq.nsmallest(self.width >> 1, layer, key = self.score))
+        for x in heapq.nsmallest(self.width, layer, key = self.tchisla.log_height):
+            if len(keep) == self.width:
+                break
+            keep.add(x)
+        self.tchisla.with_dependencies(digits, keep)
+        self.tchisla.layers.retain(digits, keep)
+
+    def solve(self, target, *, max_depth = None, deadline = None):
+        tchisla = self.tchisla
+        tchisla.target = tchisla.constructor(target)
+        tchisla.max_depth = max_depth
+        tchisla.deadline = deadline
+        self.target_log = tchisla.log_value(tchisla.target)
+        self.interrupted = False
+        for digits in count(1):
+            if digits - 1 == max_depth:
+                return
+            try:
+                tchisla.search(digits)
+            except SolutionFoundError as solution:
+                return solution.message[1]
+            except SearchInterruptedError as interruption:
+                self.interrupted = interruption.message[0]
+                return
+            self.prune(digits)
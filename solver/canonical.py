@@ -0,0 +1,189 @@
+import math
+from functools import partial
+from itertools import islice
+from gmpy2 import mpq as Fraction, is_square, isqrt
+from expression import Expression
+from solver.base import SolutionFoundError
+from solver.rational import RationalTchisla
+
+__all__ = ["CanonicalRationalTchisla"]
+
+# RationalTchisla storing x and 1 / x of the same depth as a single entry
+# (digits, expression, reciprocal expression) under the one >= 1, the
+# reciprocal orientation is expanded implicitly during pair evaluation
+class CanonicalRationalTchisla(RationalTchisla):
+    # pairs are evaluated by entry, not by value
+    ordered = False
+
+    @classmethod
+    def create(cls):
+        instance = super().create()
+        instance.mirrored = {}
+        return instance
+
+    @staticmethod
+    def name():
+        return "canonical"
+
+    def key(self, x):
+        if x in self.solutions:
+            return x
+        if x < 1:
+            y = x ** -1
+            if len(self.solutions.get(y, ())) == 3:
+                return y
+
+    def entry(self, x):
+        entry = self.solutions.get(x)
+        if entry is None:
+            if x < 1:
+                entry = self.solutions.get(x ** -1)
+                if entry is not None and len(entry) == 3:
+                    return entry[0], entry[2]
+            return
+        return entry[:2]
+
+    def store(self, x, digits, expression, reciprocal = None):
+        if reciprocal is None:
+            super().store(x, digits, expression)
+            return
+        self.solutions[x] = digits, expression, reciprocal
+        if self.scratch is None:
+            self.visited[digits].append(x)
+        else:
+            self.scratch.append((x, digits))
+        if self.target in (x, x ** -1):
+            raise SolutionFoundError((self.target, digits))
+
+    def check(self, x, digits, op, p, q = None, *, need_sqrt = True):
+        if not self.range_check(x) or x in self.solutions:
+            return
+        if x < 1 and len(self.solutions.get(x ** -1, ())) == 3:
+            return
+        self.insert(x, digits, op, p, q)
+        if need_sqrt:
+            self.sqrt(x, digits)
+        if self.integer_check(x):
+            self.factorial(x, digits)
+
+    def check_reciprocal(self, x, digits, op, p, q, inverse_op, inverse_p, inverse_q):
+        # x and 1 / x built from the same operands, stored together if both are new
+        if not self.range_check(x):
+            return
+        if x < 1:
+            x = x ** -1
+            op, p, q, inverse_op, inverse_p, inverse_q = inverse_op, inverse_p, inverse_q, op, p, q
+        y = x ** -1
+        if x == 1 or x in self.solutions or y in self.solutions:
+            self.check(x, digits, op, p, q)
+            self.check(y, digits, inverse_op, inverse_p, inverse_q)
+            return
+        self.store(
+            x, digits,
+            op(p) if q is None else op(p, q),
+            inverse_op(inverse_p) if inverse_q is None else inverse_op(inverse_p, inverse_q)
+        )
+        if is_square(x.numerator) and is_square(x.denominator):
+            z = Fraction(isqrt(x.numerator), isqrt(x.denominator))
+            self.check_reciprocal(z, digits, Expression.sqrt, x, None, Expression.sqrt, y, None)
+        if self.integer_check(x):
+            self.factorial(x, digits)
+
+    def reciprocal_flags(self, digits):
+        # finished layers only, whether each entry stands for 1 / x too
+        layer = self.visited[digits]
+        if digits not in self.mirrored or len(self.mirrored[digits]) != len(layer):
+            solutions = self.solutions
+            self.mirrored[digits] = bytes(len(solutions[x]) == 3 for x in layer)
+        return self.mirrored[digits]
+
+    def operand_values(self, digits):
+        flags = self.reciprocal_flags(digits)
+        for x, mirrored in zip(self.visited[digits], flags):
+            yield x
+            if mirrored:
+                yield x ** -1
+
+    def unary_preimages(self, x):
+        # reachable sets hold both orientations, an entry stands for x and 1 / x
+        yield from super().unary_preimages(x)
+        yield x ** -1
+
+    def forget(self, digits):
+        super().forget(digits)
+        for d in [d for d in self.mirrored if d >= digits]:
+            del self.mirrored[d]
+
+    def row_generator(self, d1, start, stop, digits):
+        d2 = digits - d1
+        first, second = self.visited[d1], self.visited[d2]
+        first_flags, second_flags = self.reciprocal_flags(d1), self.reciprocal_flags(d2)
+        limits = self.exponent_limits(d2)
+        for index in range(start, stop):
+            offset = index if d1 == d2 else 0
+            p, p_mirrored = first[index], first_flags[index]
+            p_exponents, p_odd = self.exponent_row(p, d2)
+            for q, q_mirrored, limit in zip(islice(second, offset, None), islice(second_flags, offset, None), islice(limits, offset, None)):
+                yield p, p_mirrored, q, q_mirrored, (q in p_exponents) | (0 < p_odd <= limit) << 1
+
+    def pair_operation(self, p, p_mirrored, q, q_mirrored, powers, digits):
+        inverse_p = p ** -1 if p_mirrored else None
+        inverse_q = q ** -1 if q_mirrored else None
+        for x in (p, inverse_p):
+            if x is None:
+                continue
+            for y in (q, inverse_q):
+                if y is not None:
+                    self.add(x, y, digits)
+                    self.subtract(x, y, digits)
+        # products and quotients of all the orientations are p * q, p / q and their reciprocals
+        if inverse_p is not None:
+            self.check_reciprocal(p * q, digits, Expression.multiply, p, q, Expression.divide, inverse_p, q)
+        elif inverse_q is not None:
+            self.check_reciprocal(p * q, digits, Expression.multiply, p, q, Expression.divide, inverse_q, p)
+        else:
+            self.multiply(p, q, digits)
+        self.check_reciprocal(p / q, digits, Expression.divide, p, q, Expression.divide, q, p)
+        # only p and q themselves may be integers, any orientation of the base gives x and 1 / x
+        if powers & 1:
+            self.exponent(p, q, digits)
+        if powers & 2:
+            self.exponent(q, p, digits)
+
+    def expand(self, digits):
+        for p, p_mirrored, q, q_mirrored, powers in self.binary_generator(digits):
+            self.pair_operation(p, p_mirrored, q, q_mirrored, powers, digits)
+            yield
+        for p, q in self.factorial_generator(digits):
+            self.factorial_divide(p, q, digits)
+            yield
+
+    def shared_layout(self):
+        # entries standing for 1 / x too are not published
+        return None
+
+    def expand_fused(self, digits):
+        # pairs of entries are not pairs of values, the fused loop of RationalTchisla does not apply
+        return self.expand(digits)
+
+    def exponent(self, p, q, digits):
+        if q.denominator != 1 or p == 1:
+            return
+        p_digits = math.log2(max(p.numerator, p.denominator))
+        q_int = q.numerator
+        folds = 0
+        while p_digits * q_int > self.MAX_DIGITS:
+            if q_int & 1 == 0:
+                q_int >>= 1
+                folds += 1
+            else:
+                return
+        x = p ** q_int
+        if folds:
+            self.check_reciprocal(
+                x, digits,
+                partial(Expression.folded_power, folds), p, q,
+                partial(Expression.folded_negative_power, folds), p, q
+            )
+        else:
+            self.check_reciprocal(x, digits, Expression.power, p, q, Expression.negative_power, p, q)
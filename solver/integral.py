@@ -1,46 +1,150 @@
 import math
-from gmpy2 import is_square, isqrt
+from functools import partial
+from itertools import islice
+from math import isqrt
+from gmpy2 import is_square
 from expression import Expression
-from solver.base import BaseTchisla
+from solver.base import BaseTchisla, SolutionFoundError
+from solver.shared import IntegerLayout
 
 __all__ = ["IntegralTchisla"]
 
 class IntegralTchisla(BaseTchisla):
     constructor = int
+    ordered = True
 
     def __init__(self, n):
         super().__init__(n)
+        # values stay Python ints, gmpy2 only answers is_square and its results
+        # are never converted back
+        self.factorials = [math.factorial(x) for x in range(self.MAX_FACTORIAL + 1)]
 
     @staticmethod
     def name():
         return "integral"
 
+    def shared_layout(self):
+        return IntegerLayout() if self.MAX <= 1 << 64 else None
+
     def range_check(self, x):
         return x <= self.MAX
 
     def integer_check(self, x):
         return True
 
+    def admits(self, x):
+        return x.denominator == 1 and 0 < x <= self.MAX
+
+    def log_value(self, x):
+        return math.log(x)
+
+    def log_height(self, x):
+        return math.log(x)
+
+    def product_bound(self, p):
+        return self.MAX // p
+
+    def exponent_window(self, q):
+        # bases with log2(p) * q <= MAX_DIGITS, with some slack for rounding
+        return 2, 2 ** (self.MAX_DIGITS / q + 1)
+
+    def target_operands(self, p):
+        target = self.target
+        operands = [(self.add, target - p), (self.subtract, p - target), (self.subtract, p + target), (self.divide, p * target)]
+        if target % p == 0:
+            operands.append((self.multiply, target // p))
+        if p % target == 0:
+            operands.append((self.divide, p // target))
+        return operands
+
     def divide(self, p, q, digits):
         if p < q:
             p, q = q, p
         if p % q == 0:
-            self.check(p // q, digits, Expression.divide(p, q))
+            self.check(p // q, digits, Expression.divide, p, q)
+
+    def expand_fused(self, digits):
+        # only exact quotients are kept, a single range check on the sum and the product
+        solutions, exponent, exponents, MAX, MAX_DIGITS = self.solutions, self.exponent, self.exponents, self.MAX, self.MAX_DIGITS
+        insert = self.fused_insert(digits)
+        add, subtract, multiply, divide = Expression.add, Expression.subtract, Expression.multiply, Expression.divide
+        for d1 in range(1, (digits >> 1) + 1):
+            d2 = digits - d1
+            first, second = self.visited[d1], self.visited[d2]
+            for index, p in enumerate(first):
+                # the exponents q of p, and the bases q of p as an exponent, with some slack
+                p_exponents = exponents(d2, MAX_DIGITS / math.log2(p) + 1) if p != 1 else ()
+                q_bound = self.exponent_window(p // (p & -p))[1]
+                for q in islice(second, index if d1 == d2 else 0, None):
+                    x = p + q
+                    if x <= MAX and x not in solutions:
+                        insert(x, add(p, q))
+                    if p > q:
+                        x = p - q
+                        if x not in solutions:
+                            insert(x, subtract(p, q))
+                    elif p < q:
+                        x = q - p
+                        if x not in solutions:
+                            insert(x, subtract(q, p))
+                    x = p * q
+                    if x <= MAX and x not in solutions:
+                        insert(x, multiply(p, q))
+                    if p < q:
+                        if q % p == 0:
+                            x = q // p
+                            if x not in solutions:
+                                insert(x, divide(q, p))
+                    elif p % q == 0:
+                        x = p // q
+                        if x not in solutions:
+                            insert(x, divide(p, q))
+                    if q in p_exponents:
+                        exponent(p, q, digits)
+                    if 1 < q <= q_bound:
+                        exponent(q, p, digits)
+                    yield
+        for p, q in self.factorial_generator(digits):
+            self.factorial_divide(p, q, digits)
+            yield
 
     def exponent(self, p, q, digits):
         if p == 1:
             return
         p_digits = math.log2(p)
-        exp = Expression.power(p, q)
-        while p_digits * q > self.MAX_DIGITS:
-            if q & 1 == 0:
-                q >>= 1
-                exp = Expression.sqrt(exp)
+        q_int = q
+        folds = 0
+        while p_digits * q_int > self.MAX_DIGITS:
+            if q_int & 1 == 0:
+                q_int >>= 1
+                folds += 1
             else:
                 return
-        self.check(p ** q, digits, exp)
+        self.check(p ** q_int, digits, partial(Expression.folded_power, folds) if folds else Expression.power, p, q)
 
     def sqrt(self, x, digits):
         if is_square(x):
-            y = int(isqrt(x))
-            self.check(y, digits, Expression.sqrt(x))
+            self.check(isqrt(x), digits, Expression.sqrt, x)
+
+    def factorial(self, x, digits):
+        if x <= self.MAX_FACTORIAL:
+            self.check(self.factorials[x], digits, Expression.factorial, x)
+
+    def fused_insert(self, digits):
+        # the insert of BaseTchisla with the sqrt / factorial chains inlined
+        solutions, layer, scratch = self.solutions, self.visited[digits], self.scratch
+        check, factorials, MAX_FACTORIAL = self.check, self.factorials, self.MAX_FACTORIAL
+        sqrt, factorial = Expression.sqrt, Expression.factorial
+        def insert(x, expression):
+            solutions[x] = digits, expression
+            if scratch is None:
+                layer.append(x)
+            else:
+                scratch.append((x, digits))
+            if x == self.target:
+                raise SolutionFoundError((x, digits))
+            if is_square(x):
+                check(isqrt(x), digits, sqrt, x)
+            if x <= MAX_FACTORIAL:
+                check(factorials[x], digits, factorial, x)
+        return insert
@@ -0,0 +1,64 @@
+from itertools import islice
+
+__all__ = ["LayerStore"]
+
+# solutions maps each value to its (digits, expression), visited[digits] is the
+# append-only log of the values of each depth, in insertion order
+class LayerStore:
+    __slots__ = ("solutions", "visited", "marks", "new_layer")
+
+    def __init__(self, new_layer = list):
+        self.solutions = {}
+        self.visited = [None]
+        self.marks = {}
+        self.new_layer = new_layer
+
+    def __contains__(self, x):
+        return x in self.solutions
+
+    def __getitem__(self, x):
+        return self.solutions[x]
+
+    def __len__(self):
+        return len(self.solutions)
+
+    def add(self, x, digits, expression):
+        self.solutions[x] = digits, expression
+        self.visited[digits].append(x)
+
+    def layer(self, digits):
+        while len(self.visited) <= digits:
+            self.visited.append(self.new_layer())
+        return self.visited[digits]
+
+    def mark(self, digits):
+        # only the first mark of a depth counts, what is logged before it is
+        # kept across restarts (factorial_divide of the previous depth)
+        if digits not in self.marks:
+            self.marks[digits] = len(self.layer(digits))
+        return self.marks[digits]
+
+    def rollback(self, digits):
+        layer = self.visited[digits]
+        mark = self.marks.get(digits, len(layer))
+        for x in islice(layer, mark, None):
+            del self.solutions[x]
+        del layer[mark:]
+
+    def discard(self, digits):
+        # every value of a depth, marked ones included
+        layer = self.visited[digits]
+        for x in layer:
+            del self.solutions[x]
+        del layer[:]
+        self.marks.pop(digits, None)
+
+    def retain(self, digits, keep):
+        layer = self.visited[digits]
+        kept = self.new_layer()
+        for x in layer:
+            if x in keep:
+                kept.append(x)
+            else:
+                del self.solutions[x]
+        self.visited[digits] = kept
@@ -0,0 +1,221 @@
+import math
+import operator
+from functools import partial, reduce
+from array import array
+from math import gcd
+from gmpy2 import mpq as Fraction, fac as factorial, is_square, isqrt
+from expression import Expression
+from solver.base import BaseTchisla
+from solver.shared import PackedLayout
+
+__all__ = ["PackedRationalTchisla"]
+
+# rationals of RationalTchisla packed as (numerator - 1) << shift | (denominator - 1),
+# values are always positive and integers have their low bits cleared
+class PackedRationalTchisla(BaseTchisla):
+    def __init__(self, n):
+        super().__init__(n)
+        self.SHIFT = (self.MAX - 1).bit_length()
+        self.MASK = (1 << self.SHIFT) - 1
+        self.typecode = "Q" if self.SHIFT <= 32 else None
+
+    @staticmethod
+    def name():
+        return "packed"
+
+    def new_layer(self):
+        return array(self.typecode) if self.typecode else []
+
+    def constructor(self, x):
+        x = Fraction(x)
+        return self.pack(x.numerator, x.denominator)
+
+    def pack(self, numerator, denominator):
+        return (numerator - 1) << self.SHIFT | (denominator - 1)
+
+    def value(self, x):
+        return Fraction((x >> self.SHIFT) + 1, (x & self.MASK) + 1)
+
+    def log_value(self, x):
+        return math.log((x >> self.SHIFT) + 1) - math.log((x & self.MASK) + 1)
+
+    def log_height(self, x):
+        return math.log(max((x >> self.SHIFT) + 1, (x & self.MASK) + 1))
+
+    def check_fraction(self, numerator, denominator, digits, op, p, q = None):
+        g = gcd(numerator, denominator)
+        if g != 1:
+            numerator //= g
+            denominator //= g
+        if numerator <= self.MAX and denominator <= self.MAX:
+            self.check((numerator - 1) << self.SHIFT | (denominator - 1), digits, op, p, q)
+
+    def check_integer(self, x, digits, op, p, q = None):
+        if x <= self.MAX:
+            self.check((x - 1) << self.SHIFT, digits, op, p, q)
+
+    def target_operands(self, p):
+        x, target = self.value(p), self.value(self.target)
+        for op, q in (
+            (self.add, target - x),
+            (self.subtract, x - target),
+            (self.subtract, x + target),
+            (self.multiply, target / x),
+            (self.divide, x / target),
+            (self.divide, x * target)
+        ):
+            if q > 0 and q.numerator <= self.MAX and q.denominator <= self.MAX:
+                yield op, self.pack(q.numerator, q.denominator)
+
+    def shared_layout(self):
+        return PackedLayout() if self.typecode else None
+
+    def range_check(self, x):
+        # packed values are range checked before packing
+        return True
+
+    def integer_check(self, x):
+        return x & self.MASK == 0
+
+    def rational_value(self, x):
+        return Fraction((x >> self.SHIFT) + 1, (x & self.MASK) + 1)
+
+    def admits(self, x):
+        return x > 0 and x.numerator <= self.MAX and x.denominator <= self.MAX
+
+    def concat(self, digits):
+        if digits <= self.MAX_CONCAT:
+            x = (10 ** digits - 1) // 9 * self.n
+            if x <= self.MAX:
+                x = self.pack(x, 1)
+                self.check(x, digits, Expression.concat, x)
+
+    def add(self, p, q, digits):
+        shift, mask = self.SHIFT, self.MASK
+        if p & mask == 0 and q & mask == 0:
+            self.check_integer((p >> shift) + (q >> shift) + 2, digits, Expression.add, p, q)
+            return
+        a, b = (p >> shift) + 1, (p & mask) + 1
+        c, d = (q >> shift) + 1, (q & mask) + 1
+        self.check_fraction(a * d + b * c, b * d, digits, Expression.add, p, q)
+
+    def subtract(self, p, q, digits):
+        if p == q:
+            return
+        shift, mask = self.SHIFT, self.MASK
+        if p & mask == 0 and q & mask == 0:
+            if p < q:
+                p, q = q, p
+            self.check_integer((p - q) >> shift, digits, Expression.subtract, p, q)
+            return
+        a, b = (p >> shift) + 1, (p & mask) + 1
+        c, d = (q >> shift) + 1, (q & mask) + 1
+        numerator = a * d - b * c
+        if numerator < 0:
+            self.check_fraction(-numerator, b * d, digits, Expression.subtract, q, p)
+        else:
+            self.check_fraction(numerator, b * d, digits, Expression.subtract, p, q)
+
+    def multiply(self, p, q, digits):
+        shift, mask = self.SHIFT, self.MASK
+        if p & mask == 0 and q & mask == 0:
+            self.check_integer(((p >> shift) + 1) * ((q >> shift) + 1), digits, Expression.multiply, p, q)
+            return
+        a, b = (p >> shift) + 1, (p & mask) + 1
+        c, d = (q >> shift) + 1, (q & mask) + 1
+        self.check_fraction(a * c, b * d, digits, Expression.multiply, p, q)
+
+    def divide(self, p, q, digits):
+        shift, mask = self.SHIFT, self.MASK
+        a, b = (p >> shift) + 1, (p & mask) + 1
+        c, d = (q >> shift) + 1, (q & mask) + 1
+        numerator, denominator = a * d, b * c
+        if numerator < denominator:
+            self.check_fraction(denominator, numerator, digits, Expression.divide, q, p)
+            self.check_fraction(numerator, denominator, digits, Expression.divide, p, q)
+        else:
+            self.check_fraction(numerator, denominator, digits, Expression.divide, p, q)
+            self.check_fraction(denominator, numerator, digits, Expression.divide, q, p)
+
+    def integer_value(self, x):
+        return (x >> self.SHIFT) + 1
+
+    def factorial_divide(self, p, q, digits):
+        mask = self.MASK
+        if p == q or p & mask or q & mask:
+            return
+        x = (p >> self.SHIFT) + 1
+        y = (q >> self.SHIFT) + 1
+        if x < y:
+            x, y = y, x
+            p, q = q, p
+        if x <= self.MAX_FACTORIAL or y <= 2 or x - y == 1 or (
+            (x - y) * (math.log2(x) + math.log2(y)) > self.MAX_DIGITS << 1
+        ):
+            return
+        result = reduce(operator.mul, range(x, y, -1))
+        self.check_integer(result, digits, Expression.factorial_quotient, p, q)
+        if digits == self.max_depth:
+            return
+        if self.solutions[q][0] == 1:
+            self.check_integer(result - 1, digits + 1, Expression.factorial_quotient_minus_one, p, q)
+            self.check_integer(result + 1, digits + 1, Expression.factorial_quotient_plus_one, p, q)
+            self.check_integer(result >> 1, digits + 1, Expression.factorial_quotient_half, p, q)
+        if self.solutions[p][0] == 1:
+            self.check_integer(result << 1, digits + 1, Expression.factorial_quotient_double, p, q)
+
+    def exponent(self, p, q, digits):
+        if q & self.MASK or p == 0:
+            return
+        a, b = (p >> self.SHIFT) + 1, (p & self.MASK) + 1
+        p_digits = math.log2(max(a, b))
+        q_int = (q >> self.SHIFT) + 1
+        folds = 0
+        while p_digits * q_int > self.MAX_DIGITS:
+            if q_int & 1 == 0:
+                q_int >>= 1
+                folds += 1
+            else:
+                return
+        a **= q_int
+        b **= q_int
+        if a <= self.MAX and b <= self.MAX:
+            if folds:
+                self.check(self.pack(a, b), digits, partial(Expression.folded_power, folds), p, q)
+                self.check(self.pack(b, a), digits, partial(Expression.folded_negative_power, folds), p, q)
+            else:
+                self.check(self.pack(a, b), digits, Expression.power, p, q)
+                self.check(self.pack(b, a), digits, Expression.negative_power, p, q)
+
+    def sqrt(self, x, digits):
+        a, b = (x >> self.SHIFT) + 1, (x & self.MASK) + 1
+        if is_square(a) and is_square(b):
+            y = self.pack(int(isqrt(a)), int(isqrt(b)))
+            self.check(y, digits, Expression.sqrt, x)
+
+    def factorial(self, x, digits):
+        x_int = (x >> self.SHIFT) + 1
+        if x_int <= self.MAX_FACTORIAL:
+            self.check_integer(int(factorial(x_int)), digits, Expression.factorial, x)
+
+    def decode(self, expression):
+        if type(expression) is Expression:
+            return Expression(expression.name, *map(self.decode, expression.args))
+        return self.value(expression)
+
+    def printer(self, n):
+        digits, expression = self.solutions[n]
+        string = str(digits) + ": " + str(self.value(n))
+        if expression.name == "concat":
+            return string
+        else:
+            return string + " = " + Expression.str(self.decode(expression), spaces = True)
+
+    def full_expression(self, n):
+        if type(n) is Expression:
+            return Expression(n.name, *map(self.full_expression, n.args))
+        _, expression = self.solutions[n]
+        if expression.name == "concat":
+            return self.value(n)
+        else:
+            return Expression(expression.name, *map(self.full_expression, expression.args))
@@ -0,0 +1,51 @@
+import multiprocessing
+
+__all__ = ["Portfolio"]
+
+def work(solver, connection, best):
+    # one process per solver, its instances stay warm from a problem to the next
+    while True:
+        task = connection.recv()
+        if task is None:
+            break
+        n, target, max_depth, deadline = task
+        tchisla = solver(n)
+        solution = tchisla.solve(target, max_depth = max_depth, deadline = deadline, bound = best)
+        depth = None if solution is None else solution.depth
+        result = {"depth": depth, "interrupted": tchisla.interrupted, "depth_finished": tchisla.depth_finished}
+        if solution is not None:
+            with best.get_lock():
+                if best.value == 0 or depth < best.value:
+                    best.value = depth
+            # values are sent as strings, the parent has no layers to print them from
+            result["solution"] = solution.steps
+            result["expression"] = str(solution.expression)
+        connection.send(result)
+
+# solvers racing on the same problem, each one stops searching the depths that
+# cannot beat the best solution found so far by any of them
+class Portfolio:
+    __slots__ = ("best", "workers")
+
+    def __init__(self, solvers):
+        # forked workers inherit global_config and the instances already built
+        context = multiprocessing.get_context("fork")
+        self.best = context.Value("i", 0)
+        self.workers = {}
+        for key, solver in solvers.items():
+            connection, child = context.Pipe()
+            process = context.Process(target = work, args = (solver, child, self.best), daemon = True)
+            process.start()
+            self.workers[key] = process, connection
+
+    def solve(self, keys, n, target, *, max_depth = None, deadline = None):
+        self.best.value = 0 if max_depth is None else max_depth + 1
+        for key in keys:
+            self.workers[key][1].send((n, target, max_depth, deadline))
+        return {key: self.workers[key][1].recv() for key in keys}
+
+    def close(self):
+        for process, connection in self.workers.values():
+            connection.send(None)
+        for process, connection in self.workers.values():
+            process.join()
@@ -1,8 +1,13 @@
 import math
+import operator
+from array import array
+from functools import partial
+from itertools import islice
 from gmpy2 import mpq as Fraction, is_square, isqrt
-from quadratic import Quadratic
+from quadratic import Quadratic, primes
 from expression import Expression
 from solver.base import BaseTchisla
+from solver.shared import EncodedLayout
 
 __all__ = ["QuadraticTchisla"]
 
@@ -13,10 +18,20 @@ class QuadraticTchisla(BaseTchisla):
         super().__init__(n)
         self.MAX_QUADRATIC_POWER = self.limits["max_quadratic_power"]
 
+    @classmethod
+    def create(cls):
+        instance = super().create()
+        instance.radical_ids = {}
+        instance.radicals = {}
+        return instance
+
     @staticmethod
     def name():
         return "quadratic"
 
+    def shared_layout(self):
+        return EncodedLayout()
+
     def range_check(self, x):
         x = x.rational_part
         return x.numerator <= self.MAX and x.denominator <= self.MAX
@@ -24,10 +39,25 @@ class QuadraticTchisla(BaseTchisla):
     def integer_check(self, x):
         return x.quadratic_power == 0 and x.rational_part.denominator == 1
 
+    def reachable(self, budget, limit):
+        # values with a radical part are not inverted, bounded searches keep every value
+        return None
+
+    def log_value(self, x):
+        r = x.rational_part
+        value = math.log(r.numerator) - math.log(r.denominator)
+        if x.quadratic_power:
+            value += sum(map(operator.mul, x.quadratic_part, map(math.log, primes))) / (1 << x.quadratic_power)
+        return value
+
+    def log_height(self, x):
+        r = x.rational_part
+        return math.log(max(r.numerator, r.denominator)) + x.quadratic_power
+
     def add(self, p, q, digits):
         result = p + q
         if result is not None:
-            self.check(result, digits, Expression.add(p, q))
+            self.check(result, digits, Expression.add, p, q)
 
     def subtract(self, p, q, digits):
         if p == q:
@@ -37,46 +67,148 @@ class QuadraticTchisla(BaseTchisla):
             if result.rational_part < 0:
                 result = -result
                 p, q = q, p
-            self.check(result, digits, Expression.subtract(p, q))
+            self.check(result, digits, Expression.subtract, p, q)
 
     def multiply(self, p, q, digits):
-        self.check(p * q, digits, Expression.multiply(p, q))
+        self.check(p * q, digits, Expression.multiply, p, q)
 
     def divide(self, p, q, digits):
         quotient = p / q
-        self.check(quotient, digits, Expression.divide(p, q))
-        self.check(quotient ** -1, digits, Expression.divide(q, p))
+        self.check(quotient, digits, Expression.divide, p, q)
+        self.check(quotient ** -1, digits, Expression.divide, q, p)
+
+    def radical_classes(self, digits):
+        # finished layers only, the radical class (quadratic_power, quadratic_part)
+        # of each value as a small integer, add / subtract give nothing across classes
+        layer = self.visited[digits]
+        if digits not in self.radicals or len(self.radicals[digits]) != len(layer):
+            ids = self.radical_ids
+            self.radicals[digits] = array("H", (
+                ids.setdefault((x.quadratic_power, x.quadratic_part), len(ids)) for x in layer
+            ))
+        return self.radicals[digits]
+
+    def forget(self, digits):
+        super().forget(digits)
+        for d in [d for d in self.radicals if d >= digits]:
+            del self.radicals[d]
+
+    def exponent_limit(self, x):
+        # a radical base allows MAX_DIGITS more bits for each of its square roots
+        if x == 1:
+            return 0
+        r = x.rational_part
+        height = math.log2(max(r.numerator, r.denominator))
+        return (self.MAX_DIGITS << x.quadratic_power) / height + 1 if height else math.inf
+
+    def row_generator(self, d1, start, stop, digits):
+        d2 = digits - d1
+        first, second = self.visited[d1], self.visited[d2]
+        first_classes, second_classes = self.radical_classes(d1), self.radical_classes(d2)
+        limits = self.exponent_limits(d2)
+        for index in range(start, stop):
+            offset = index if d1 == d2 else 0
+            p, p_class = first[index], first_classes[index]
+            p_exponents, p_odd = self.exponent_row(p, d2)
+            for q, q_class, limit in zip(islice(second, offset, None), islice(second_classes, offset, None), islice(limits, offset, None)):
+                yield p, q, p_class == q_class, (q in p_exponents) | (0 < p_odd <= limit) << 1
+
+    def pair_operation(self, p, q, same, powers, digits):
+        if same:
+            self.add(p, q, digits)
+            self.subtract(p, q, digits)
+        self.multiply(p, q, digits)
+        self.divide(p, q, digits)
+        if powers & 1:
+            self.exponent(p, q, digits)
+        if powers & 2:
+            self.exponent(q, p, digits)
+
+    def expand(self, digits):
+        for p, q, same, powers in self.binary_generator(digits):
+            self.pair_operation(p, q, same, powers, digits)
+            yield
+        for p, q in self.factorial_generator(digits):
+            self.factorial_divide(p, q, digits)
+            yield
+
+    def expand_fused(self, digits):
+        # add / subtract only for the pairs of the same radical class, exponent by the
+        # flags of row_generator
+        solutions, exponent, MAX = self.solutions, self.exponent, self.MAX
+        insert = self.fused_insert(digits)
+        add, subtract, multiply, divide = Expression.add, Expression.subtract, Expression.multiply, Expression.divide
+        for p, q, same, powers in self.binary_generator(digits):
+            if same:
+                x = p + q
+                r = x.rational_part
+                if r.numerator <= MAX and r.denominator <= MAX and x not in solutions:
+                    insert(x, add(p, q))
+                if p != q:
+                    x = p - q
+                    if x.rational_part < 0:
+                        x = -x
+                        r = x.rational_part
+                        if r.numerator <= MAX and r.denominator <= MAX and x not in solutions:
+                            insert(x, subtract(q, p))
+                    else:
+                        r = x.rational_part
+                        if r.numerator <= MAX and r.denominator <= MAX and x not in solutions:
+                            insert(x, subtract(p, q))
+            x = p * q
+            r = x.rational_part
+            if r.numerator <= MAX and r.denominator <= MAX and x not in solutions:
+                insert(x, multiply(p, q))
+            x = p / q
+            r = x.rational_part
+            if r.numerator <= MAX and r.denominator <= MAX and x not in solutions:
+                insert(x, divide(p, q))
+            x = x ** -1
+            r = x.rational_part
+            if r.numerator <= MAX and r.denominator <= MAX and x not in solutions:
+                insert(x, divide(q, p))
+            if powers & 1:
+                exponent(p, q, digits)
+            if powers & 2:
+                exponent(q, p, digits)
+            yield
+        for p, q in self.factorial_generator(digits):
+            self.factorial_divide(p, q, digits)
+            yield
 
     def exponent(self, p, q, digits):
         if not self.integer_check(q) or p == 1:
             return
         base = math.log2(max(p.rational_part.numerator, p.rational_part.denominator))
-        exp = Expression.power(p, q), Expression.power(p, Expression.negate(q))
         q_max = q.rational_part.numerator
+        folds = 0
         while base * q_max > self.MAX_DIGITS << p.quadratic_power:
             if q_max & 1 == 0:
                 q_max >>= 1
-                exp = Expression.sqrt(exp[0]), Expression.sqrt(exp[1])
+                folds += 1
             else:
                 return
         q_min = q_max
         while q_min & 1 == 0:
             q_min >>= 1
-            exp = Expression.sqrt(exp[0]), Expression.sqrt(exp[1])
-        q = q_min
-        x = p ** q
-        while q <= q_max:
+            folds += 1
+        power = q_min
+        x = p ** power
+        while power <= q_max:
             if not self.range_check(x):
                 break
-            self.check(x, digits, exp[0], need_sqrt = q == q_min)
-            self.check(Quadratic.inverse(x), digits, exp[1], need_sqrt = q == q_min)
-            q <<= 1
+            if folds:
+                self.check(x, digits, partial(Expression.folded_power, folds), p, q, need_sqrt = power == q_min)
+                self.check(Quadratic.inverse(x), digits, partial(Expression.folded_negative_power, folds), p, q, need_sqrt = power == q_min)
+            else:
+                self.check(x, digits, Expression.power, p, q, need_sqrt = power == q_min)
+                self.check(Quadratic.inverse(x), digits, Expression.negative_power, p, q, need_sqrt = power == q_min)
+            power <<= 1
             x = Quadratic.square(x)
-            if q <= q_max:
-                exp = exp[0].args[0], exp[1].args[0]
+            folds -= 1
 
     def sqrt(self, x, digits):
         if x.quadratic_power < self.MAX_QUADRATIC_POWER:
             y = Quadratic.sqrt(x)
             if y is not None:
-                self.check(y, digits, Expression.sqrt(x))
+                self.check(y, digits, Expression.sqrt, x)
@@ -1,12 +1,16 @@
 import math
+from functools import partial
+from itertools import islice
 from gmpy2 import mpq as Fraction, is_square, isqrt
 from expression import Expression
 from solver.base import BaseTchisla
+from solver.shared import FractionLayout, EncodedLayout
 
 __all__ = ["RationalTchisla"]
 
 class RationalTchisla(BaseTchisla):
     constructor = Fraction
+    ordered = True
 
     def __init__(self, n):
         super().__init__(n)
@@ -15,30 +19,110 @@ class RationalTchisla(BaseTchisla):
     def name():
         return "rational"
 
+    def shared_layout(self):
+        shift = (self.MAX - 1).bit_length()
+        return FractionLayout(shift) if shift <= 32 else EncodedLayout()
+
     def range_check(self, x):
         return x.numerator <= self.MAX and x.denominator <= self.MAX
 
     def integer_check(self, x):
         return x.denominator == 1
 
+    def log_value(self, x):
+        return math.log(x.numerator) - math.log(x.denominator)
+
+    def log_height(self, x):
+        return math.log(max(x.numerator, x.denominator))
+
+    def product_bound(self, p):
+        return self.MAX / p
+
+    def quotient_window(self, p):
+        # both p / q and q / p are out of range outside of it
+        return p / self.MAX, p * self.MAX
+
+    def exponent_window(self, q):
+        # bases with log2(max(p, 1 / p)) * q <= MAX_DIGITS, with some slack for rounding
+        bound = 2 ** (self.MAX_DIGITS / q + 1)
+        return 1 / bound, bound
+
+    def expand_fused(self, digits):
+        # both parts of each fraction are range checked, the bases of p as an exponent
+        # are found by their magnitude
+        solutions, exponent, exponents, MAX, MAX_DIGITS = self.solutions, self.exponent, self.exponents, self.MAX, self.MAX_DIGITS
+        insert = self.fused_insert(digits)
+        add, subtract, multiply, divide = Expression.add, Expression.subtract, Expression.multiply, Expression.divide
+        for d1 in range(1, (digits >> 1) + 1):
+            d2 = digits - d1
+            first, second = self.visited[d1], self.visited[d2]
+            for index, p in enumerate(first):
+                # the bases q of p as an exponent are only searched for integers p
+                p_exponents = exponents(d2, MAX_DIGITS / math.log2(max(p.numerator, p.denominator)) + 1) if p != 1 else ()
+                if p.denominator == 1:
+                    q_low, q_high = self.exponent_window(p.numerator // (p.numerator & -p.numerator))
+                else:
+                    q_low, q_high = 1, 0
+                for q in islice(second, index if d1 == d2 else 0, None):
+                    x = p + q
+                    if x.numerator <= MAX and x.denominator <= MAX and x not in solutions:
+                        insert(x, add(p, q))
+                    if p > q:
+                        x = p - q
+                        if x.numerator <= MAX and x.denominator <= MAX and x not in solutions:
+                            insert(x, subtract(p, q))
+                    elif p < q:
+                        x = q - p
+                        if x.numerator <= MAX and x.denominator <= MAX and x not in solutions:
+                            insert(x, subtract(q, p))
+                    x = p * q
+                    if x.numerator <= MAX and x.denominator <= MAX and x not in solutions:
+                        insert(x, multiply(p, q))
+                    # p / q and q / p are both in range or both out of it
+                    x = p / q
+                    if x.numerator <= MAX and x.denominator <= MAX:
+                        y = x ** -1
+                        if x < 1:
+                            if y not in solutions:
+                                insert(y, divide(q, p))
+                            if x not in solutions:
+                                insert(x, divide(p, q))
+                        else:
+                            if x not in solutions:
+                                insert(x, divide(p, q))
+                            if y not in solutions:
+                                insert(y, divide(q, p))
+                    if q in p_exponents:
+                        exponent(p, q, digits)
+                    if q_low <= q <= q_high and q != 1:
+                        exponent(q, p, digits)
+                    yield
+        for p, q in self.factorial_generator(digits):
+            self.factorial_divide(p, q, digits)
+            yield
+
     def exponent(self, p, q, digits):
         if q.denominator != 1 or p == 1:
             return
         p_digits = math.log2(max(p.numerator, p.denominator))
         q_int = q.numerator
-        exp = Expression.power(p, q), Expression.power(p, Expression.negate(q))
+        folds = 0
         while p_digits * q_int > self.MAX_DIGITS:
             if q_int & 1 == 0:
                 q_int >>= 1
-                exp = Expression.sqrt(exp[0]), Expression.sqrt(exp[1])
+                folds += 1
             else:
                 return
         x = p ** q_int
-        self.check(x, digits, exp[0])
-        self.check(x ** -1, digits, exp[1])
+        if folds:
+            self.check(x, digits, partial(Expression.folded_power, folds), p, q)
+            self.check(x ** -1, digits, partial(Expression.folded_negative_power, folds), p, q)
+        else:
+            self.check(x, digits, Expression.power, p, q)
+            self.check(x ** -1, digits, Expression.negative_power, p, q)
 
     def sqrt(self, x, digits):
         if is_square(x.numerator) and is_square(x.denominator):
             y = isqrt(x.numerator)
             z = isqrt(x.denominator)
-            self.check(Fraction(y, z), digits, Expression.sqrt(x))
+            self.check(Fraction(y, z), digits, Expression.sqrt, x)
@@ -0,0 +1,241 @@
+import weakref
+from array import array
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context, shared_memory
+from gmpy2 import mpq as Fraction
+from codec import dumps, loads
+from solver import threads
+
+__all__ = ["IntegerLayout", "PackedLayout", "FractionLayout", "EncodedLayout", "expand"]
+
+# how the values of a solver are written to shared memory, as unsigned 64 bit
+# keys when they fit (typecode "Q"), as codec bytes otherwise. The keys of a
+# layout are ordered the same way in every process
+class IntegerLayout:
+    # integral values are 1 to MAX <= 1 << 64
+    typecode = "Q"
+
+    def encode(self, x):
+        return x - 1
+
+    def decode(self, key):
+        return key + 1
+
+class PackedLayout:
+    # PackedRationalTchisla values are already keys
+    typecode = "Q"
+    encode = decode = None
+
+class FractionLayout:
+    typecode = "Q"
+
+    def __init__(self, shift):
+        self.shift = shift
+        self.mask = (1 << shift) - 1
+
+    def encode(self, x):
+        return (x.numerator - 1) << self.shift | (x.denominator - 1)
+
+    def decode(self, key):
+        return Fraction((key >> self.shift) + 1, (key & self.mask) + 1)
+
+class EncodedLayout:
+    typecode = None
+    encode = staticmethod(dumps)
+    decode = staticmethod(loads)
+
+class EncodedKeys:
+    __slots__ = ("offsets", "data")
+
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        return bytes(self.data[self.offsets[index]:self.offsets[index + 1]])
+
+def pack(layout, keys):
+    if layout.typecode:
+        return array(layout.typecode, keys).tobytes()
+    keys = list(keys)
+    offsets = array("Q", [0])
+    for key in keys:
+        offsets.append(offsets[-1] + len(key))
+    return offsets.tobytes() + b"".join(keys)
+
+def unpack(layout, buffer, length):
+    # (keys, end of the keys in buffer, memoryviews to release before closing)
+    if layout.typecode:
+        keys = buffer[:length << 3].cast(layout.typecode)
+        return keys, length << 3, (keys,)
+    offsets = buffer[:(length + 1) << 3].cast("Q")
+    start = (length + 1) << 3
+    end = start + offsets[length]
+    data = buffer[start:end]
+    return EncodedKeys(offsets, data), end, (offsets, data)
+
+# a finished layer, read-only in the workers
+class SharedLayer:
+    __slots__ = ("keys", "decode")
+
+    def __init__(self, keys, decode):
+        self.keys = keys
+        self.decode = decode
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __getitem__(self, index):
+        return self.decode(self.keys[index])
+
+    def __iter__(self):
+        return map(self.decode, self.keys)
+
+# the values of the finished layers sorted by key, with their depth, standing
+# for solutions in the workers. Expressions are never read there
+class SharedIndex:
+    __slots__ = ("keys", "depths", "encode")
+
+    def __init__(self, keys, depths, encode):
+        self.keys = keys
+        self.depths = depths
+        self.encode = encode
+
+    def find(self, x):
+        key = x if self.encode is None else self.encode(x)
+        index = bisect_left(self.keys, key)
+        if index < len(self.keys) and self.keys[index] == key:
+            return index
+
+    def __contains__(self, x):
+        return self.find(x) is not None
+
+    def __getitem__(self, x):
+        index = self.find(x)
+        if index is None:
+            raise KeyError(x)
+        return self.depths[index], None
+
+def create_block(data):
+    block = shared_memory.SharedMemory(create = True, size = max(1, len(data)))
+    block.buf[:len(data)] = data
+    return block
+
+def release(blocks):
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+# the blocks of an instance, each finished layer is written once, the index
+# again when a depth is added
+class Publication:
+    __slots__ = ("layout", "layers", "index")
+
+    def __init__(self, layout):
+        self.layout = layout
+        self.layers = {}
+        self.index = None
+
+    def release(self):
+        release(block for _, block in self.layers.values())
+        if self.index is not None:
+            release((self.index[1],))
+        self.layers = {}
+        self.index = None
+
+    def publish(self, tchisla, digits):
+        layout = self.layout
+        encode = layout.encode or (lambda x: x)
+        changed = False
+        for d in range(1, digits):
+            layer = tchisla.visited[d]
+            if d in self.layers and self.layers[d][0] == len(layer):
+                continue
+            if d in self.layers:
+                release((self.layers.pop(d)[1],))
+            self.layers[d] = len(layer), create_block(pack(layout, map(encode, layer)))
+            changed = True
+        if changed or self.index is None or self.index[0] != digits:
+            if self.index is not None:
+                release((self.index[1],))
+            entries = sorted((encode(x), d) for d in range(1, digits) for x in tchisla.visited[d])
+            data = pack(layout, [key for key, _ in entries]) + bytes(d for _, d in entries)
+            self.index = digits, create_block(data), len(entries)
+        return (
+            [(self.layers[d][1].name, self.layers[d][0]) for d in range(1, digits)],
+            (self.index[1].name, self.index[2])
+        )
+
+executors = {}
+# blocks mapped by a worker, unpacked once
+attached = {}
+instances = {}
+# the layer blocks each worker instance last read, its per-layer indexes belong to them
+instance_layers = {}
+
+def executor(workers):
+    # forked workers inherit the solver classes, global_config and the limits
+    if workers not in executors:
+        executors[workers] = ProcessPoolExecutor(workers, mp_context = get_context("fork"))
+    return executors[workers]
+
+def attach(name, length, layout):
+    if name not in attached:
+        block = shared_memory.SharedMemory(name)
+        keys, end, views = unpack(layout, block.buf, length)
+        # only the index has depths after its keys
+        depths = block.buf[end:end + length]
+        attached[name] = block, views + (depths,), keys, depths
+    return attached[name][2:]
+
+def detach(names):
+    # blocks of the previous tasks, unlinked by the parent since
+    for name in list(attached):
+        if name not in names:
+            block, views, _, _ = attached.pop(name)
+            for view in views:
+                view.release()
+            block.close()
+
+def work(cls, n, layers, index, max_depth, digits, unit):
+    if (cls, n) not in instances:
+        tchisla = cls.create()
+        tchisla.__init__(n)
+        instances[cls, n] = tchisla
+    tchisla = instances[cls, n]
+    # another instance of the same solver and digit (beam search makes one per
+    # problem), or layers published again, same lengths do not mean same values
+    names = [name for name, _ in layers]
+    previous = instance_layers.get((cls, n), [])
+    changed = next((d for d, (name, old) in enumerate(zip(names, previous), 1) if name != old), min(len(names), len(previous)) + 1)
+    tchisla.forget(changed)
+    instance_layers[cls, n] = names
+    layout = tchisla.shared_layout()
+    detach({name for name, _ in layers} | {index[0]})
+    visited = [None]
+    for name, length in layers:
+        keys, _ = attach(name, length, layout)
+        visited.append(keys if layout.decode is None else SharedLayer(keys, layout.decode))
+    keys, depths = attach(*index, layout)
+    tchisla.visited = visited
+    tchisla.solutions = SharedIndex(keys, depths, layout.encode)
+    tchisla.max_depth = max_depth
+    try:
+        return threads.collect(tchisla, digits, unit)
+    finally:
+        tchisla.visited = tchisla.solutions = None
+
+def expand(tchisla, digits, workers):
+    # the thread pipeline with worker processes, the finished layers are
+    # published in shared memory once and the workers only send candidates back
+    if tchisla.shared is None:
+        tchisla.shared = Publication(tchisla.shared_layout())
+        weakref.finalize(tchisla, tchisla.shared.release)
+    layers, index = tchisla.shared.publish(tchisla, digits)
+    pool = executor(workers)
+    cls, n, max_depth = type(tchisla), tchisla.n, tchisla.max_depth
+    return threads.pipeline(tchisla, digits, workers, lambda unit: pool.submit(work, cls, n, layers, index, max_depth, digits, unit))
@@ -0,0 +1,118 @@
+import sys, threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice, repeat
+
+__all__ = ["gil_enabled", "expand", "pipeline", "collect"]
+
+executors = {}
+executors_lock = threading.Lock()
+collector_classes = {}
+
+def gil_enabled():
+    # sys._is_gil_enabled only exists on Python 3.13 and later
+    enabled = getattr(sys, "_is_gil_enabled", None)
+    return enabled is None or enabled()
+
+def executor(workers):
+    with executors_lock:
+        if workers not in executors:
+            executors[workers] = ThreadPoolExecutor(workers, thread_name_prefix = "tchisla")
+        return executors[workers]
+
+# candidates of a unit of pairs are recorded instead of inserted, the instance
+# checks them again in the order of the sequential expansion
+class Collector:
+    __slots__ = ()
+
+    def check(self, x, digits, op, p, q = None, *, need_sqrt = True):
+        # known values are skipped by check anyway, and only an earlier candidate
+        # of the unit can insert x before this one
+        if not self.range_check(x) or x in self.solutions or x in self.seen:
+            return
+        self.seen.add(x)
+        self.candidates[self.phase].append((False, (x, digits, op, p, q), need_sqrt))
+
+    def check_reciprocal(self, x, digits, *args):
+        if self.range_check(x):
+            self.candidates[self.phase].append((True, (x, digits) + args, None))
+
+    # expand walks the pairs of a unit once for each of its phases
+    def binary_generator(self, digits):
+        self.phase += 1
+        return self.row_generator(*self.unit, digits)
+
+    def factorial_generator(self, digits):
+        self.phase += 1
+        return self.factorial_rows(*self.unit, digits)
+
+def collector(tchisla, unit):
+    cls = type(tchisla)
+    if cls not in collector_classes:
+        collector_classes[cls] = type(cls.__name__ + "Collector", (Collector, cls), {})
+    instance = object.__new__(collector_classes[cls])
+    # a view of the instance, layers are shared and only read
+    for klass in cls.__mro__:
+        for name in getattr(klass, "__slots__", ()):
+            if hasattr(tchisla, name):
+                setattr(instance, name, getattr(tchisla, name))
+    instance.__dict__.update(tchisla.__dict__)
+    instance.unit = unit
+    instance.phase = -1
+    instance.seen = set()
+    instance.candidates = [], []
+    return instance
+
+def collect(tchisla, digits, unit):
+    instance = collector(tchisla, unit)
+    pairs = [0, 0]
+    for _ in instance.expand(digits):
+        pairs[instance.phase] += 1
+    return instance.candidates, pairs
+
+def replay(tchisla, candidates):
+    check = tchisla.check
+    for reciprocal, args, need_sqrt in candidates:
+        if reciprocal:
+            tchisla.check_reciprocal(*args)
+        else:
+            check(*args, need_sqrt = need_sqrt)
+
+def units(tchisla, digits, workers):
+    # rows of the first layer of each pair of depths, about as many pairs each
+    size = max(1, tchisla.pair_count(digits) // (workers << 3))
+    for d1 in range(1, (digits >> 1) + 1):
+        rows, columns = len(tchisla.visited[d1]), len(tchisla.visited[digits - d1])
+        step = max(1, size // max(1, columns))
+        for start in range(0, rows, step):
+            yield d1, start, min(start + step, rows)
+
+def pipeline(tchisla, digits, workers, submit):
+    # same values, depths and expressions as tchisla.expand, the units are
+    # evaluated by submit(unit) and only their candidates are checked here
+    pending = deque()
+    remaining = units(tchisla, digits, workers)
+    # a bounded number of units in flight, an interrupted expansion stops soon
+    for unit in islice(remaining, workers << 1):
+        pending.append(submit(unit))
+    deferred = []
+    try:
+        while pending:
+            candidates, pairs = pending.popleft().result()
+            unit = next(remaining, None)
+            if unit is not None:
+                pending.append(submit(unit))
+            replay(tchisla, candidates[0])
+            yield from repeat(None, pairs[0])
+            deferred.append((candidates[1], pairs[1]))
+        # factorial_divide comes after every other operation of the depth
+        for candidates, pairs in deferred:
+            replay(tchisla, candidates)
+            yield from repeat(None, pairs)
+    finally:
+        for future in pending:
+            future.cancel()
+
+def expand(tchisla, digits, workers):
+    pool = executor(workers)
+    return pipeline(tchisla, digits, workers, lambda unit: pool.submit(collect, tchisla, digits, unit))
@@ -0,0 +1,27 @@
+import os, sys, subprocess
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def run(*args):
+    return subprocess.run(
+        [sys.executable, os.path.join(root, "main.py"), *args],
+        cwd = root, capture_output = True, text = True, timeout = 300
+    )
+
+def test_portfolio_with_processes():
+    # the portfolio workers expand their depths themselves, nothing is left in shared memory
+    before = set(os.listdir("/dev/shm"))
+    result = run("-p", "--processes", "2", "-d", "6", "2017#4")
+    assert result.returncode == 0, result.stderr
+    assert "2017 = " in result.stdout
+    assert "leaked shared_memory" not in result.stderr
+    assert set(os.listdir("/dev/shm")) <= before
+
+def test_deferred_problem_printed_once():
+    # 2017 # 4 needs a depth over the limit and is tried again after 2018 # 4
+    result = run("--admission", "defer", "--max-pairs", "200000", "-b", "50", "[2017,2018]#4")
+    assert result.returncode == 0, result.stderr
+    lines = result.stdout.splitlines()
+    assert lines.count("2017 # 4") == lines.count("2018 # 4") == 1
+    assert lines.index("2018 # 4") < lines.index("2017 # 4")
+    assert lines.count("beam search (integral): 6 digits or less") == 1
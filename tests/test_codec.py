@@ -0,0 +1,62 @@
+import pickle
+from fractions import Fraction as PyFraction
+import pytest
+from gmpy2 import mpz, mpq
+from expression import Expression
+from quadratic import Quadratic
+from codec import dumps, loads
+
+def same(x, y):
+    if type(x) is not type(y):
+        return False
+    if type(x) is Expression:
+        return x.name == y.name and len(x.args) == len(y.args) and all(map(same, x.args, y.args))
+    if type(x) in (tuple, list):
+        return len(x) == len(y) and all(map(same, x, y))
+    if type(x) is Quadratic:
+        return (x.rational_part, x.quadratic_power, x.quadratic_part) == (y.rational_part, y.quadratic_power, y.quadratic_part)
+    return x == y
+
+@pytest.mark.parametrize("x", [
+    0, 1, 0x7f, 0x80, -1, -0x80, -0x81, 1 << 63, 1 << 64, (1 << 64) + 1, -(1 << 64), 3 ** 200, -(7 ** 150),
+    mpz(0), mpz(-5), mpz(1) << 100, -(mpz(3) ** 90),
+    mpq(2, 3), mpq(-7, 4), mpq(1 << 80, 3), mpq(-1, (1 << 70) + 1),
+    None, "", "sqrt", (), (1, -2), [mpq(1, 2), [None]]
+])
+def test_values(x):
+    assert same(loads(dumps(x)), x)
+
+@pytest.mark.parametrize("x", [
+    Quadratic(5),
+    Quadratic(mpq(-3, 7)),
+    Quadratic(mpq(3, 5), 1, (1, 1, 0, 0)),
+    Quadratic(mpq(-(1 << 70), 11), 3, (1, 5, 3, 7)),
+    Quadratic(1, 2, (0, 1, 2, 3))
+])
+def test_quadratic(x):
+    assert same(loads(dumps(x)), x)
+
+def test_shared_subtrees():
+    leaf = Expression("sqrt", mpq(4, 9))
+    product = Expression("*", leaf, leaf)
+    x = loads(dumps([(mpq(4, 9), (1, leaf)), (mpq(16, 81), (2, Expression("+", product, product)))]))
+    assert x[0][1][1] is x[1][1][1].args[0].args[0]
+    assert x[1][1][1].args[0] is x[1][1][1].args[1]
+    assert x[0][0] is x[0][1][1].args[0]
+
+def test_unknown_names():
+    x = Expression("folded", Expression("gamma", 5), Expression("√", -1), Expression("+", 1, 2))
+    assert same(loads(dumps(x)), x)
+
+def test_unknown_leaves():
+    with pytest.raises(TypeError):
+        dumps(Expression("+", 1.5, 2))
+    # pickled the default way instead
+    x = Expression("+", 1.5, Expression("*", PyFraction(1, 3), mpq(2, 3)))
+    assert same(pickle.loads(pickle.dumps(x)), x)
+
+def test_pickle():
+    x = Expression("^", Quadratic(2, 1, (1, 0, 0, 0)), Expression("negate", -(1 << 90)))
+    data = pickle.dumps(x)
+    assert b"codec" in data
+    assert same(pickle.loads(data), x)
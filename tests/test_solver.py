@@ -0,0 +1,22 @@
+import threading
+from solver.integral import IntegralTchisla
+
+def test_shared_instance_between_threads():
+    # the solutions returned are read under the lock, another thread may solve
+    # something else on the same instance right after
+    targets = list(range(1000, 1040))
+    results = {}
+    def work(targets):
+        for target in targets:
+            tchisla = IntegralTchisla(4)
+            results[target] = tchisla.solve(target, max_depth = 6)
+    threads = [threading.Thread(target = work, args = (targets[i::8],)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for target in targets:
+        solution = results[target]
+        assert solution is not None
+        assert solution.steps[0].startswith("{}: {} = ".format(solution.depth, target))
+        assert str(solution.expression)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+import os, json, time
+from argparse import ArgumentParser
+from itertools import groupby
+from config import limits
+from main import solvers, parse_problems, fetchRecord
+
+# candidate values of a limit, from the loosest (its default) to the tightest
+def candidates(key, default):
+    if key == "max":
+        return [1 << k for k in range(default.bit_length() - 1, 0, -1)]
+    lowest = 0 if key == "max_quadratic_power" else 1
+    return list(range(default, lowest - 1, -1))
+
+def run(solver, n, problems, overrides):
+    name = solver.name()
+    saved = limits[name].get(n)
+    limits[name][n] = overrides
+    try:
+        tchisla = solver.detached(n)
+    finally:
+        if saved is None:
+            del limits[name][n]
+        else:
+            limits[name][n] = saved
+    start = time.monotonic()
+    for target, depth in problems:
+        found = tchisla.solve(target, max_depth = depth)
+        if found is None:
+            return
+    return len(tchisla.solutions), time.monotonic() - start
+
+def known_depths(solver_key, n, targets, options):
+    solver = solvers[solver_key]
+    problems = []
+    for target in targets:
+        if not solver["regex"].match(str(target)):
+            continue
+        if options.wr:
+            depth = fetchRecord(target, n)
+        else:
+            solution = solver["solver"].detached(n).solve(solver["constructor"](target), max_depth = options.max_depth)
+            depth = None if solution is None else solution.depth
+        if depth is not None:
+            problems.append((solver["constructor"](target), depth))
+    return problems
+
+def tune(solver_key, n, problems):
+    solver = solvers[solver_key]["solver"]
+    default = limits[solver.name()]["default"]
+    overrides = dict(limits[solver.name()].get(n, {}))
+    reference = run(solver, n, problems, overrides)
+    if reference is None:
+        return overrides, None, None
+    for key in default:
+        values = candidates(key, overrides.get(key, default[key]))
+        # binary search of the tightest value still giving every known depth
+        lo, hi = 0, len(values) - 1
+        while lo < hi:
+            mid = (lo + hi + 1) >> 1
+            if run(solver, n, problems, dict(overrides, **{key: values[mid]})) is None:
+                hi = mid - 1
+            else:
+                lo = mid
+        overrides[key] = values[lo]
+    return overrides, reference, run(solver, n, problems, overrides)
+
+def main():
+    parser = ArgumentParser(description='find the tightest solver limits that still solve a corpus of problems at their known depth')
+    parser.add_argument('-s', '--add-solver',
+        dest='solvers',
+        action='append',
+        choices=list(solvers.keys()),
+        help='solvers to tune, default is integral and rational'
+    )
+    parser.add_argument('-d', '--max-depth',
+        type=int,
+        help='max search depth when computing the known depths with the default limits'
+    )
+    parser.add_argument('-w', '--wr',
+        action='store_true',
+        default=False,
+        help='take the known depths from the world records instead of the default limits'
+    )
+    parser.add_argument('-o', '--output',
+        default='limits.json',
+        help='limits profile to write, existing entries of other solvers and digits are kept'
+    )
+    parser.add_argument('problem',
+        nargs='+',
+        help='corpus of problems, same syntax as main.py'
+    )
+    options = parser.parse_args()
+    if not options.solvers:
+        options.solvers = ['integral', 'rational']
+
+    profile = {}
+    if os.path.exists(options.output):
+        with open(options.output) as f:
+            profile = json.load(f)
+    for n, problems in groupby(parse_problems(options.problem), key = lambda x: x[1]):
+        targets = [target for target, _ in problems]
+        for solver_key in options.solvers:
+            corpus = known_depths(solver_key, n, targets, options)
+            if not corpus:
+                continue
+            overrides, before, after = tune(solver_key, n, corpus)
+            if before is None:
+                print('{} #{}: known depths not reached with the current limits, skipped'.format(solver_key, n), flush = True)
+                continue
+            name = solvers[solver_key]["solver"].name()
+            default = limits[name]["default"]
+            profile.setdefault(name, {})[str(n)] = {key: value for key, value in overrides.items() if value != default[key]}
+            print('{} #{}: {} problems'.format(solver_key, n, len(corpus)))
+            for key in default:
+                print('  {}: {} -> {}'.format(key, default[key], overrides[key]))
+            print('  values: {} -> {} ({:.1%})'.format(before[0], after[0], 1 - after[0] / before[0]))
+            print('  time: {:.2f}s -> {:.2f}s'.format(before[1], after[1]), flush = True)
+            with open(options.output, 'w') as f:
+                json.dump(profile, f, indent = '\t', sort_keys = True)
+
+if __name__ == "__main__":
+    main()